@@ -4,23 +4,45 @@ Created on Thu May 25 11:23:20 2017
 
 @author: Jan
 """
+import os
+import copy
+import json
+import pickle
+import hashlib
 import random
 import string
+import multiprocessing
 import numpy as np
 from numpy.random import choice
-from collections import Counter
+from collections import OrderedDict
 import datetime
 
+FREQ_LETTERS = "etaoinshrdlcumwfgypbvkjxqz"
+WORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "words.txt")
+
 class HangmanGame(object):
+    """Single game of Hangman with letters tracked as 26-bit masks
+    
+    `positions[c]` is the bitmask of positions of the c-th letter in the
+    secret word, so an update takes a few integer operations. The revealed
+    word is only built when asked for.
+    """
+    __slots__ = ("secretWord", "lenght", "guess_left", "guessed", "hits",
+                 "revealed", "positions", "result", "candidates", "_guessedWord")
     
     def __init__(self, secretWord, guess_left=8):
         self.secretWord = secretWord
         self.lenght = len(self.secretWord)
         self.guess_left = guess_left
-        self.letters_left = list(string.ascii_lowercase)
-        self.guessed_letters = []
-        self.guessedWord = HangmanGame.getGuessedWord(self.secretWord, self.guessed_letters)
+        self.guessed = 0
+        self.hits = 0
+        self.revealed = 0
+        self.positions = [0] * 26
+        for i, c in enumerate(secretWord):
+            self.positions[ord(c) - 97] |= 1 << i
         self.result = None
+        self.candidates = None
+        self._guessedWord = None
         
     def get_secretWord(self):
         return self.secretWord
@@ -32,17 +54,30 @@ class HangmanGame(object):
         return self.guess_left
         
     def get_letters_left(self):
-        return self.letters_left
+        return [c for i, c in enumerate(string.ascii_lowercase) if not self.guessed >> i & 1]
         
     def get_guessed_letters(self):
-        return self.guessed_letters
+        return [c for i, c in enumerate(string.ascii_lowercase) if self.hits >> i & 1]
+        
+    def get_guessed_mask(self):
+        return self.guessed
         
     def get_guessedWord(self):
-        return self.guessedWord
+        if self._guessedWord is None:
+            self._guessedWord = "".join(c if self.revealed >> i & 1 else "_"
+                                        for i, c in enumerate(self.secretWord))
+        return self._guessedWord
         
     def get_result(self):
         return self.result
         
+    def copy(self):
+        """Independent copy of the game state, e.g. to branch a game"""
+        game = copy.copy(self)
+        if self.candidates is not None:
+            game.candidates = self.candidates.copy()
+        return game
+        
     def getGuessedWord(secretWord, lettersGuessed):
         check = ""
         
@@ -55,17 +90,374 @@ class HangmanGame(object):
         return check
         
     def update(self, letter):
-        self.letters_left.remove(letter)
-        if letter not in self.secretWord:
+        code = ord(letter) - 97 if len(letter) == 1 else -1
+        if not 0 <= code < 26 or self.guessed >> code & 1:
+            raise ValueError("Letter %r is not available" %letter)
+        self.guessed |= 1 << code
+        positions = self.positions[code]
+        if self.candidates is not None:
+            self.candidates.update(letter, positions)
+        if positions == 0:
             self.guess_left -= 1
-            if self.get_guess_left() == 0:
-                self.result = 0            
+            if self.guess_left == 0:
+                self.result = 0
         else:
-           self.guessed_letters.append(letter)
-           self.guessedWord = HangmanGame.getGuessedWord(self.secretWord, self.guessed_letters)
+            self.hits |= 1 << code
+            self.revealed |= positions
+            self._guessedWord = None
+            if self.revealed == (1 << self.lenght) - 1:
+                self.result = 1
+               
+def words_digest(words):
+    """Hash of the words, independent of their order and of how they are stored"""
+    return hashlib.sha1("\n".join(sorted(words, key=lambda w: (len(w), w))).encode()).hexdigest()
+    
+class WordList(object):
+    """Read-only word list backed by a compiled, memory-mapped cache
+    
+    The cache directory next to the source file holds the words sorted by
+    lenght as a zero-padded uint8 matrix, the lenght of every word, offsets
+    of the lenght buckets (words of lenght l are rows offsets[l]:offsets[l+1])
+    and the letter bitmask of every word. It is built once from the text
+    file, rebuilt whenever the source changes and loaded with np.memmap, so
+    all players and worker processes share one copy through the page cache.
+    
+    :param path: text file with one word per line
+    """
+    ARRAYS = ("matrix", "lenghts", "offsets", "masks")
+    
+    def __init__(self, path=WORDS_PATH):
+        self.path = path
+        self.cache = path + ".cache"
+        stamp = self._cache_stamp()
+        if stamp is None or "digest" not in stamp or \
+                {k: stamp.get(k) for k in ("size", "mtime_ns")} != self._source_stamp():
+            self.compile()
+            stamp = self._cache_stamp()
+        self.digest = stamp["digest"]
+        for name in WordList.ARRAYS:
+            setattr(self, name, np.load(os.path.join(self.cache, name + ".npy"), mmap_mode="r"))
+            
+    def __len__(self):
+        return len(self.lenghts)
+        
+    def __getitem__(self, i):
+        return self.matrix[i, :self.lenghts[i]].tobytes().decode("ascii")
+        
+    def __reduce__(self):
+        # workers reopen the memory map instead of receiving pickled words
+        return WordList, (self.path,)
+        
+    def bucket(self, lenght):
+        """Slice of rows holding the words of given lenght"""
+        return slice(self.offsets[lenght], self.offsets[lenght + 1])
+        
+    def source(self):
+        """Identifier of the words, see `words_digest`"""
+        return self.digest
+        
+    def _source_stamp(self):
+        stat = os.stat(self.path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        
+    def _cache_stamp(self):
+        try:
+            with open(os.path.join(self.cache, "stamp.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+            
+    def compile(self):
+        """Builds the cache from the text file"""
+        stamp = self._source_stamp()
+        with open(self.path) as f:
+            words = [line.strip().lower() for line in f]
+        words = [w for w in words if w]
+        words.sort(key=len)
+        lenghts = np.array([len(w) for w in words], dtype=np.uint16)
+        filled = np.arange(lenghts.max()) < lenghts[:, None]
+        matrix = np.zeros(filled.shape, dtype=np.uint8)
+        matrix[filled] = np.frombuffer("".join(words).encode("ascii"), dtype=np.uint8)
+        offsets = np.searchsorted(lenghts, np.arange(lenghts.max() + 2))
+        bits = np.where(filled, np.uint32(1) << (matrix - 97).astype(np.uint32), 0)
+        arrays = {"matrix": matrix, "lenghts": lenghts, "offsets": offsets,
+                  "masks": np.bitwise_or.reduce(bits.astype(np.uint32), axis=1)}
+        os.makedirs(self.cache, exist_ok=True)
+        for name, array in arrays.items():
+            tmp = os.path.join(self.cache, name + ".npy.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp, os.path.join(self.cache, name + ".npy"))
+        with open(os.path.join(self.cache, "stamp.json"), "w") as f:
+            json.dump(dict(stamp, digest=words_digest(words)), f)
+            
+class WordIndex(object):
+    """Word list bucketed by length for fast candidate narrowing
+    
+    Every bucket holds the words of one length as a (n, lenght) uint8 matrix
+    of letters and a uint32 array with the bitmask of letters in each word.
+    `source` identifies the words of the list, see `words_digest`.
+    """
+    def __init__(self, wordlist):
+        self.letters = {}
+        self.masks = {}
+        if isinstance(wordlist, WordList):
+            self.source = wordlist.source()
+            # buckets are read-only views into the shared memory map
+            for lenght in np.unique(wordlist.lenghts).tolist():
+                rows = wordlist.bucket(lenght)
+                self.letters[lenght] = wordlist.matrix[rows, :lenght]
+                self.masks[lenght] = wordlist.masks[rows]
+            return
+        self.source = words_digest(wordlist)
+        buckets = {}
+        for word in wordlist:
+            buckets.setdefault(len(word), []).append(word)
+        for lenght, words in buckets.items():
+            letters = np.frombuffer("".join(words).encode("ascii"), dtype=np.uint8)
+            letters = letters.reshape(len(words), lenght)
+            bits = np.uint32(1) << (letters - 97).astype(np.uint32)
+            self.letters[lenght] = letters
+            self.masks[lenght] = np.bitwise_or.reduce(bits, axis=1)
+            
+    def candidates(self, lenght):
+        if lenght not in self.letters:
+            return CandidateSet(np.empty((0, lenght), np.uint8), np.empty(0, np.uint32))
+        return CandidateSet(self.letters[lenght], self.masks[lenght])
+        
+class CandidateSet(object):
+    """Words of one WordIndex bucket still consistent with a game
+    
+    Updates are recorded and applied lazily, when the candidates are needed,
+    so scoring a guess costs time proportional to the number of surviving
+    candidates, not to the dictionary size.
+    """
+    def __init__(self, letters, masks):
+        self.letters = letters
+        self.masks = masks
+        self.weights = 1 << np.arange(letters.shape[1], dtype=np.int64)
+        self.pending = []
+        
+    def __len__(self):
+        self._apply()
+        return len(self.masks)
+        
+    def copy(self):
+        candidates = copy.copy(self)
+        candidates.pending = list(self.pending)
+        return candidates
+        
+    def update(self, letter, positions):
+        """Keeps words having `letter` exactly at `positions` (bitmask, 0 = miss)"""
+        self.pending.append((letter, positions))
+        
+    def _apply(self):
+        if not self.pending:
+            return
+        missed = 0
+        hits = []
+        for letter, positions in self.pending:
+            if positions == 0:
+                missed |= 1 << (ord(letter) - 97)
+            else:
+                hits.append((letter, positions))
+        self.pending = []
+        required = sum(1 << (ord(letter) - 97) for letter, _ in hits)
+        keep = (self.masks & np.uint32(missed | required)) == required
+        self.letters = self.letters[keep]
+        self.masks = self.masks[keep]
+        for letter, positions in hits:
+            keep = (self.letters == ord(letter)).dot(self.weights) == positions
+            self.letters = self.letters[keep]
+            self.masks = self.masks[keep]
+            
+    def split(self, letter):
+        """Groups candidates by positions of `letter`, yields (positions, CandidateSet)"""
+        self._apply()
+        positions = (self.letters == ord(letter)).dot(self.weights)
+        order = np.argsort(positions, kind="stable")
+        values, starts = np.unique(positions[order], return_index=True)
+        for value, ids in zip(values, np.split(order, starts[1:])):
+            yield int(value), CandidateSet(self.letters[ids], self.masks[ids])
+        
+    def letter_counts(self):
+        """Occurrences of letters a-z over all candidates"""
+        self._apply()
+        return np.bincount(self.letters.ravel(), minlength=123)[97:]
+        
+def choose_letter(counts, guessed):
+    """Most frequent letter not guessed yet, ties go to the later letter
+    
+    :param counts: occurrences of letters a-z among the candidates
+    :param guessed: bitmask of already guessed letters
+    """
+    scores = counts * 26 + np.arange(26)
+    scores[(guessed >> np.arange(26)) & 1 == 1] = -1
+    return chr(97 + int(scores.argmax()))
+    
+_word_index = (None, None)
+
+def get_word_index(wordlist):
+    """Returns WordIndex of the wordlist, builds it only once per wordlist"""
+    global _word_index
+    if _word_index[0] is not wordlist:
+        _word_index = (wordlist, WordIndex(wordlist))
+    return _word_index[1]
 
-           if self.get_secretWord() == self.get_guessedWord():
-               self.result = 1
+
+class PolicyCache(object):
+    """Bounded LRU cache of the BrutePlayer policy, game state -> letter
+    
+    The state key is (revealed pattern, bitmask of guessed letters), which
+    fully determines the remaining candidates and so the chosen letter.
+    Precomputed policy trees live in a separate table that is never evicted
+    and can be saved to and loaded from disk. The policy depends on the word
+    list, so the cache is bound to the `source` of one WordIndex and cleared
+    when bound to another one.
+    
+    :param maxsize: maximum number of states kept in the LRU part
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.source = None
+        self.table = {}
+        self._lru = OrderedDict()
+        
+    def bind(self, index):
+        """Uses the cache for the word list of `index`"""
+        if index.source != self.source:
+            self.source = index.source
+            self.table = {}
+            self._lru.clear()
+        
+    @staticmethod
+    def key(game):
+        return game.get_guessedWord(), game.get_guessed_mask()
+        
+    def get(self, key):
+        letter = self.table.get(key)
+        if letter is None:
+            letter = self._lru.get(key)
+            if letter is not None:
+                self._lru.move_to_end(key)
+        if letter is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return letter
+        
+    def put(self, key, letter):
+        self._lru[key] = letter
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+            
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "maxsize": self.maxsize,
+                "currsize": len(self._lru), "tablesize": len(self.table)}
+            
+    def precompute(self, index, lenghts, guess_left=8):
+        """Stores the full policy tree for words of given lenghts in the table"""
+        self.bind(index)
+        for lenght in lenghts:
+            self._explore(index.candidates(lenght), "_" * lenght, 0, guess_left)
+            
+    def _explore(self, candidates, pattern, guessed, guess_left):
+        letter = choose_letter(candidates.letter_counts(), guessed)
+        self.table[(pattern, guessed)] = letter
+        guessed |= 1 << (ord(letter) - 97)
+        for positions, subset in candidates.split(letter):
+            if positions == 0:
+                if guess_left > 1:
+                    self._explore(subset, pattern, guessed, guess_left - 1)
+            else:
+                revealed = "".join(letter if positions >> i & 1 else c
+                                   for i, c in enumerate(pattern))
+                if "_" in revealed:
+                    self._explore(subset, revealed, guessed, guess_left)
+                    
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump({"source": self.source, "table": self.table}, f)
+            
+    def load(self, path, index):
+        """Loads a saved table, it must be built from the word list of `index`"""
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+        if not isinstance(saved, dict) or saved.get("source") != index.source:
+            raise ValueError("Policy in %s was not built from this word list" %path)
+        self.bind(index)
+        self.table.update(saved["table"])
+               
+class BatchHangmanGame(object):
+    """Many Hangman games played at once, held as NumPy arrays
+    
+    Secret words are stored as a zero-padded uint8 matrix, guessed letters
+    as 26-bit masks and remaining guesses as counters. Every update applies
+    one guess to all running games. Result of a game is -1 while it runs,
+    1 for a win and 0 for a loss.
+    """
+    ALL_LETTERS = np.uint32((1 << 26) - 1)
+    
+    def __init__(self, secretWords, guess_left=8, rng=None):
+        lenghts = np.array([len(w) for w in secretWords])
+        filled = np.arange(lenghts.max()) < lenghts[:, None]
+        self.secretWords = np.zeros(filled.shape, dtype=np.uint8)
+        self.secretWords[filled] = np.frombuffer("".join(secretWords).encode("ascii"), dtype=np.uint8)
+        self.lenghts = lenghts
+        bits = np.where(filled, np.uint32(1) << (self.secretWords - 97).astype(np.uint32), 0)
+        self.word_masks = np.bitwise_or.reduce(bits.astype(np.uint32), axis=1)
+        self.guessed = np.zeros(len(lenghts), dtype=np.uint32)
+        self.guess_left = np.full(len(lenghts), guess_left, dtype=np.int8)
+        self.result = np.full(len(lenghts), -1, dtype=np.int8)
+        self.num_guesses = 0
+        self.rng = np.random.default_rng() if rng is None else rng
+        
+    @classmethod
+    def from_wordlist(cls, wordlist, num_games, guess_left=8, rng=None):
+        """Games with secret words drawn uniformly from the wordlist"""
+        rng = np.random.default_rng() if rng is None else rng
+        ids = rng.integers(len(wordlist), size=num_games)
+        return cls([wordlist[i] for i in ids], guess_left, rng)
+        
+    def __len__(self):
+        return len(self.result)
+        
+    def copy(self, rng=None):
+        """Independent copy of the game states, optionally with a new rng"""
+        games = copy.copy(self)
+        games.guessed = self.guessed.copy()
+        games.guess_left = self.guess_left.copy()
+        games.result = self.result.copy()
+        if rng is not None:
+            games.rng = rng
+        return games
+        
+    def get_active(self):
+        return self.result == -1
+        
+    def get_guessed_matrix(self):
+        """Boolean matrix (games x 26) of already guessed letters"""
+        return ((self.guessed[:, None] >> np.arange(26, dtype=np.uint32)) & 1).astype(bool)
+        
+    def get_guessedWords(self):
+        hidden = (self.guessed[:, None] >> (self.secretWords - 97).astype(np.uint32)) & 1 == 0
+        shown = np.where(hidden, ord("_"), self.secretWords)
+        return [shown[i, :n].tobytes().decode("ascii") for i, n in enumerate(self.lenghts)]
+        
+    def update(self, letters):
+        """Applies one guess per game, `letters` are letter codes 0-25"""
+        active = self.get_active()
+        bits = np.uint32(1) << np.asarray(letters).astype(np.uint32)
+        new = active & ((self.guessed & bits) == 0)
+        self.guessed |= np.where(new, bits, 0).astype(np.uint32)
+        miss = new & ((self.word_masks & bits) == 0)
+        self.guess_left -= miss
+        self.result[miss & (self.guess_left == 0)] = 0
+        self.result[active & ((self.word_masks & ~self.guessed) == 0)] = 1
+        self.num_guesses += 1
                
 class HangmanPlayer(object):
     """Abstract player class"""
@@ -78,13 +470,35 @@ class HangmanPlayer(object):
     def get_score(self):
         return np.array(self.results).mean()
         
-    def set_game(self, wordlist, guess_left=8):
-        secretWord = random.choice(wordlist)
+    def set_game(self, wordlist, guess_left=8, secretWord=None):
+        if secretWord is None:
+            secretWord = random.choice(wordlist)
         self.game = HangmanGame(secretWord, guess_left)
         
     def guess(self):
         raise NotImplementedError
         
+    batchable = False
+        
+    def guess_batch(self, games):
+        """Letter codes (0-25) to guess in every game of a BatchHangmanGame"""
+        raise NotImplementedError
+        
+    def play_batch(self, games):
+        while games.get_active().any():
+            games.update(self.guess_batch(games))
+        self.results.extend(games.result.tolist())
+        
+    def play_games(self, wordlist, num_games, batched=False, rng=None):
+        """Plays `num_games` games, all at once if the player is batchable"""
+        if batched and self.batchable:
+            games = BatchHangmanGame.from_wordlist(wordlist, num_games, rng=rng)
+            self.play_batch(games)
+        else:
+            for _ in range(num_games):
+                self.set_game(wordlist)
+                self.play_game()
+        
     def play_game(self):
         while True:
             self.guess()
@@ -103,6 +517,13 @@ class UniRandomPlayer(HangmanPlayer):
         g = random.choice(self.game.get_letters_left())
         self.game.update(g)
         
+    batchable = True
+        
+    def guess_batch(self, games):
+        keys = games.rng.random((len(games), 26))
+        keys[games.get_guessed_matrix()] = 2
+        return keys.argmin(axis=1)
+        
 class LetterFreqPlayer(HangmanPlayer):
     def __str__(self):
         return "LetterFreqPlayer"
@@ -110,16 +531,22 @@ class LetterFreqPlayer(HangmanPlayer):
     def guess(self):
         self.game.update(self.gs.pop(0))
         
-    def set_game(self, wordlist):
-        self.gs = list("etaoinshrdlcumwfgypbvkjxqz")
-        HangmanPlayer.set_game(self, wordlist)
+    def set_game(self, wordlist, secretWord=None):
+        self.gs = list(FREQ_LETTERS)
+        HangmanPlayer.set_game(self, wordlist, secretWord=secretWord)
+        
+    batchable = True
+        
+    def guess_batch(self, games):
+        code = ord(FREQ_LETTERS[games.num_guesses]) - 97
+        return np.full(len(games), code)
                 
 class RandomFreqPlayer(HangmanPlayer):
     def __str__(self):
         return "RandomFreqPlayer"
         
     def __init__(self):
-        self.gs = list("etaoinshrdlcumwfgypbvkjxqz")
+        self.gs = list(FREQ_LETTERS)
         self.weights = [0.12702,0.09056,0.08167,0.07507,0.06966,0.06749,
                         0.06327,0.06094,0.05987,0.04253,0.04025,0.02782,
                         0.02758,0.02406,0.02360,0.02228,0.02015,0.01974,
@@ -141,9 +568,9 @@ class CombFreqPlayer(LetterFreqPlayer):
         self.k = k
         self.results = []
         
-    def set_game(self, wordlist):
+    def set_game(self, wordlist, secretWord=None):
         self.count = 0
-        LetterFreqPlayer.set_game(self, wordlist)
+        LetterFreqPlayer.set_game(self, wordlist, secretWord=secretWord)
         
     def guess(self):
         if self.count < self.k:
@@ -152,33 +579,35 @@ class CombFreqPlayer(LetterFreqPlayer):
             UniRandomPlayer.guess(self)
         self.count += 1
         
+    def guess_batch(self, games):
+        if games.num_guesses < self.k:
+            return LetterFreqPlayer.guess_batch(self, games)
+        return UniRandomPlayer.guess_batch(self, games)
+        
 class BrutePlayer(HangmanPlayer):
     def __str__(self):
         return "BrutePlayer"
     
-    def set_game(self, wordlist):
-        self.wordlist = np.array(wordlist)
-        HangmanPlayer.set_game(self, wordlist)
-            
-    def compare(word, secretWord):
-        if len(word) != len(secretWord):
-            return False
-        for i in range(len(word)):
-            if word[i] != secretWord[i] and secretWord[i] != "_":
-                return False
-        return True
-        
-    f = np.vectorize(compare)
+    def set_game(self, wordlist, secretWord=None):
+        HangmanPlayer.set_game(self, wordlist, secretWord=secretWord)
+        index = get_word_index(wordlist)
+        BrutePlayer.policy.bind(index)
+        self.game.candidates = index.candidates(self.game.get_lenght())
+        
+    policy = PolicyCache()
+        
+    @staticmethod
+    def best_letter(game):
+        """Unused letter occurring most often among the remaining candidates"""
+        key = PolicyCache.key(game)
+        letter = BrutePlayer.policy.get(key)
+        if letter is None:
+            letter = choose_letter(game.candidates.letter_counts(), key[1])
+            BrutePlayer.policy.put(key, letter)
+        return letter
                         
     def guess(self):
-        ids = BrutePlayer.f(self.wordlist, self.game.get_guessedWord())
-        poss = self.wordlist[ids]
-        c = Counter("".join(list(poss)))
-        gs = []
-        for letter in self.game.get_letters_left():
-            gs.append((c[letter], letter))
-        gs.sort()
-        self.game.update(gs[-1][1])
+        self.game.update(BrutePlayer.best_letter(self.game))
         
 class SmartPlayer(HangmanPlayer):
     def __str__(self):
@@ -188,9 +617,9 @@ class SmartPlayer(HangmanPlayer):
         self.k = k
         self.results = []
         
-    def set_game(self, wordlist):
-        self.gs = list("etaoinshrdlcumwfgypbvkjxqz")
-        BrutePlayer.set_game(self, wordlist)
+    def set_game(self, wordlist, secretWord=None):
+        self.gs = list(FREQ_LETTERS)
+        BrutePlayer.set_game(self, wordlist, secretWord=secretWord)
         
     def guess(self):
         if self.game.get_guess_left() > self.k:
@@ -202,12 +631,18 @@ class HumanPlayer(HangmanPlayer):
     def __str__(self):
         return "HumanPlayer"
     
+    def set_game(self, wordlist, secretWord=None):
+        BrutePlayer.set_game(self, wordlist, secretWord=secretWord)
+    
     def guess(self):
         print("")
         print("You have %s guesses left."%self.game.get_guess_left())
         print("Letters unused: %s" %self.game.get_letters_left())
         print("Your word: %s"%self.game.get_guessedWord())
-        g = input("Please guess a letter: ")
+        g = input("Please guess a letter (? for a hint): ")
+        if g == "?":
+            print("Hint: try %s" %BrutePlayer.best_letter(self.game))
+            return
         try:
             self.game.update(g)
         except:
@@ -229,15 +664,10 @@ class HumanPlayer(HangmanPlayer):
                 print("Sorry, you ran out of guesses. The word: %s"%self.game.get_secretWord())
                 break
             
-def loadWords():
+def loadWords(path=WORDS_PATH):
     print("")
     print("Loading word list from file...")
-    # inFile: file
-    inFile = open("words.txt", 'r')
-    # wordList: list of strings
-    wordList = []
-    for line in inFile:
-        wordList.append(line.strip().lower())
+    wordList = WordList(path)
     print("  ", len(wordList), "words loaded.")
     return wordList
 
@@ -251,7 +681,12 @@ def human_play(wordlist):
         if i == "n":
             break
             
-def test_players(wordlist, players, num_simuls):
+def test_players(wordlist, players, num_simuls, batched=False):
+    """Plays `num_simuls` games with every player and prints the scores
+    
+    With `batched` the batchable players play all their games at once
+    on a BatchHangmanGame.
+    """
     print("")
     print("Testing %i players, #simulations: %i." %(len(players), num_simuls))
     tt = datetime.datetime.now()
@@ -260,14 +695,181 @@ def test_players(wordlist, players, num_simuls):
         t0 = datetime.datetime.now()
         print("")
         print("Player%i:"%num, player)
-        for _ in range(num_simuls):
-            player.set_game(wordlist)
-            player.play_game()
+        player.play_games(wordlist, num_simuls, batched)
         print("Score:", player.get_score())
         print("Test duration:", datetime.datetime.now()-t0)
         num += 1
     print("")
     print("Total duration:", datetime.datetime.now()-tt)
+
+def wilson_interval(wins, n, z=1.96):
+    """Wilson score confidence interval of a win rate"""
+    p = wins / n
+    center = (p + z**2 / (2*n)) / (1 + z**2 / n)
+    half = z * np.sqrt(p*(1-p)/n + z**2 / (4*n**2)) / (1 + z**2 / n)
+    return center - half, center + half
+    
+def test_players_adaptive(wordlist, players, max_simuls=10000, batch=500,
+                          width=0.02, z=1.96, batched=False):
+    """Version of test_players that stops as soon as the scores are known
+    
+    Players play in batches of `batch` games. A player stops once the
+    confidence interval of its win rate is narrower than `width`, once its
+    upper bound is below the lower bound of the best player, or after
+    `max_simuls` games.
+    
+    :returns: list of numbers of games played by each player
+    """
+    print("")
+    print("Adaptive testing of %i players, max #simulations: %i." %(len(players), max_simuls))
+    tt = datetime.datetime.now()
+    start = [len(player.results) for player in players]
+    intervals = [(0.0, 1.0)] * len(players)
+    reasons = [None] * len(players)
+    played = [0] * len(players)
+    while None in reasons:
+        for i, player in enumerate(players):
+            if reasons[i] is None:
+                num_games = min(batch, max_simuls - played[i])
+                player.play_games(wordlist, num_games, batched)
+                played[i] += num_games
+                intervals[i] = wilson_interval(sum(player.results[start[i]:]), played[i], z)
+        best = max(lower for lower, _ in intervals)
+        for i in range(len(players)):
+            if reasons[i] is not None:
+                continue
+            lower, upper = intervals[i]
+            if upper - lower < width:
+                reasons[i] = "interval width"
+            elif upper < best:
+                reasons[i] = "worse than best"
+            elif played[i] >= max_simuls:
+                reasons[i] = "max simulations"
+    for num, (player, (lower, upper), n, reason) in enumerate(zip(players, intervals, played, reasons), 1):
+        print("")
+        print("Player%i:"%num, player)
+        print("Score: %.4f, interval: [%.4f, %.4f]" %(np.mean(player.results[start[num-1]:]), lower, upper))
+        print("Games played: %i (%s)" %(n, reason))
+    print("")
+    print("Games played: %i of %i" %(sum(played), len(players)*max_simuls))
+    print("Total duration:", datetime.datetime.now()-tt)
+    return played
+
+_worker_wordlist = None
+
+def _init_worker(wordlist):
+    """Stores the wordlist in a pool worker, so it is sent only once"""
+    global _worker_wordlist
+    _worker_wordlist = wordlist
+    
+def _play_chunk(task):
+    """Plays one chunk of games in a pool worker with its own seed stream"""
+    player, num_games, seed, batched = task
+    random_seed, np_seed = seed.generate_state(2)
+    random.seed(int(random_seed))
+    np.random.seed(np_seed)
+    t0 = datetime.datetime.now()
+    player.play_games(_worker_wordlist, num_games, batched, rng=np.random.default_rng(seed))
+    return np.array(player.results, dtype=np.int8), datetime.datetime.now()-t0
+    
+def test_players_parallel(wordlist, players, num_simuls, n_jobs=None,
+                          chunk_size=1000, seed=None, batched=False):
+    """Parallel version of test_players using a process pool
+    
+    Games of every player are split into chunks of `chunk_size`, each chunk
+    gets its own seed spawned from `seed`, so the results are reproducible
+    regardless of `n_jobs` and chunks can be played on separate machines.
+    """
+    seeds = np.random.SeedSequence(seed)
+    print("")
+    print("Testing %i players, #simulations: %i, seed: %i." %(len(players), num_simuls, seeds.entropy))
+    tt = datetime.datetime.now()
+    sizes = [chunk_size] * (num_simuls // chunk_size)
+    if num_simuls % chunk_size:
+        sizes.append(num_simuls % chunk_size)
+    with multiprocessing.Pool(n_jobs, _init_worker, (wordlist,)) as pool:
+        for num, (player, player_seed) in enumerate(zip(players, seeds.spawn(len(players))), 1):
+            template = copy.copy(player)
+            template.results = []
+            template.__dict__.pop("game", None)
+            tasks = [(template, n, s, batched) for n, s in zip(sizes, player_seed.spawn(len(sizes)))]
+            t0 = datetime.datetime.now()
+            chunks = pool.map(_play_chunk, tasks)
+            duration = datetime.datetime.now()-t0
+            for results, _ in chunks:
+                player.results.extend(results.tolist())
+            print("")
+            print("Player%i:"%num, player)
+            print("Score:", player.get_score())
+            print("Test duration:", duration)
+            print("Worker time:", sum((t for _, t in chunks), datetime.timedelta()))
+            print("Games/sec: %.1f" %(num_simuls / duration.total_seconds()))
+    print("")
+    print("Total duration:", datetime.datetime.now()-tt)
+
+def sweep_comb_freq(wordlist, ks, num_simuls, guess_left=8, seed=None):
+    """Tests CombFreqPlayer(k) for all `ks` on common random numbers
+    
+    All players share the same secret words. The frequency order prefix
+    is played only once, CombFreqPlayer(k) branches from the state cached
+    after the first k guesses and all branches share one random stream for
+    their random guesses, which also reduces variance between the ks.
+    """
+    print("")
+    print("Sweeping CombFreqPlayer(k), k in %s, #simulations: %i." %(list(ks), num_simuls))
+    tt = datetime.datetime.now()
+    seeds = np.random.SeedSequence(seed)
+    words_seed, tail_seed = seeds.spawn(2)
+    games = BatchHangmanGame.from_wordlist(wordlist, num_simuls, guess_left,
+                                           np.random.default_rng(words_seed))
+    players = [CombFreqPlayer(k) for k in ks]
+    prefix = LetterFreqPlayer()
+    for j in range(len(FREQ_LETTERS) + 1):
+        for player in players:
+            if min(player.k, len(FREQ_LETTERS)) == j:
+                player.play_batch(games.copy(np.random.default_rng(tail_seed)))
+        if j < len(FREQ_LETTERS):
+            games.update(prefix.guess_batch(games))
+    for player in players:
+        print("%s score: %s" %(player, player.get_score()))
+    print("Total duration:", datetime.datetime.now()-tt)
+    return players
+    
+def sweep_smart(wordlist, ks, num_simuls, guess_left=8, seed=None):
+    """Tests SmartPlayer(k) for all `ks` on common random numbers
+    
+    All players share the same secret words. Every game plays the frequency
+    order prefix only once and SmartPlayer(k) branches from the cached state
+    where `guess_left` first drops to k (or from the finished game).
+    """
+    print("")
+    print("Sweeping SmartPlayer(k), k in %s, #simulations: %i." %(list(ks), num_simuls))
+    tt = datetime.datetime.now()
+    rng = np.random.default_rng(seed)
+    index = get_word_index(wordlist)
+    BrutePlayer.policy.bind(index)
+    players = {k: SmartPlayer(k) for k in ks}
+    for i in rng.integers(len(wordlist), size=num_simuls):
+        game = HangmanGame(wordlist[i], guess_left)
+        game.candidates = index.candidates(game.get_lenght())
+        pending = sorted(players, reverse=True)
+        letters = iter(FREQ_LETTERS)
+        while pending:
+            if game.get_result() is not None:
+                for k in pending:
+                    players[k].results.append(game.get_result())
+                break
+            while pending and game.get_guess_left() <= pending[0]:
+                player = players[pending.pop(0)]
+                player.game = game.copy()
+                player.play_game()
+            if pending:
+                game.update(next(letters))
+    players = [players[k] for k in ks]
+    for player in players:
+        print("%s score: %s" %(player, player.get_score()))
+    print("Total duration:", datetime.datetime.now()-tt)
+    return players
         
 if __name__ in "__main__":
     wordlist = loadWords()
@@ -282,10 +884,15 @@ if __name__ in "__main__":
 #    SmartPlayer()
 #             ]
     
+#    test_players(wordlist, players, num_simuls)
+#    test_players_adaptive(wordlist, players, num_simuls)
+    
+#    BrutePlayer.policy.precompute(get_word_index(wordlist), range(2, 9))
+#    BrutePlayer.policy.save("policy.pkl")
+#    BrutePlayer.policy.load("policy.pkl", get_word_index(wordlist))
+    
 #    num_simuls = 100
-#    players = [SmartPlayer(k) for k in range(9)]
+#    sweep_smart(wordlist, range(9), num_simuls)
 #   
     num_simuls = 10000
-    players = [CombFreqPlayer(k) for k in range(27)]
-#    
-    test_players(wordlist, players, num_simuls) 
\ No newline at end of file
+    sweep_comb_freq(wordlist, range(27), num_simuls) 
\ No newline at end of file
@@ -1,15 +1,27 @@
 """
 Scrapes images from multiple Wikipedia pages asynchronously
+
+Pages go through a pipeline of stages connected by bounded queues:
+fetch (download the page) -> parse (find images, in a process pool)
+-> download (save the images). Full queues make the previous stage wait,
+so memory stays flat however many urls there are.
+
+Pages are cached on disk and revalidated with conditional requests, images
+are deduplicated by url and content, so a repeated crawl transfers little.
 """
 import asyncio
+import functools
 import logging
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin
 
-import aiofiles
 import aiohttp
-from aiohttp import ClientSession
 from bs4 import BeautifulSoup
 
+from scheduler import CrawlScheduler
+from storage import ImageStore, PageCache
 from timeit import async_timeit
 
 logging.basicConfig(
@@ -21,26 +33,69 @@ logging.basicConfig(
 logger = logging.getLogger('WikiCrawler')
 
 
-async def fetch(url: str, session: ClientSession) -> str:
-    """Asynchronous GET request
+class Stage:
+    """Bounded input queue of a pipeline stage and its counters
     
-    :param url: url to fetch
-    :param session: open aiohttp.ClientSession
+    :param name: name of the stage in the reports
+    :param maxsize: capacity of the queue
     """
-    resp = await session.request(method="GET", url=url)
-    resp.raise_for_status()
-    logger.info(f"Got response [{resp.status}] for URL: {url}")
-    html = await resp.text()
-    return html
 
-async def parse(url: str, session: ClientSession) -> set:
-    """Asynchronously parse the page and saves all images
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.queue = asyncio.Queue(maxsize)
+        self.done = 0
+        self.last_done = 0
+
+    def report(self, interval: float) -> str:
+        """Queue depth and throughput since the previous report"""
+        rate = (self.done - self.last_done) / interval
+        self.last_done = self.done
+        return (f"{self.name}: queue {self.queue.qsize()}/{self.queue.maxsize}, "
+                f"{self.done} done, {rate:.1f}/s")
+
+
+async def worker(stage: Stage, handle) -> None:
+    """Processes items of a stage's queue with `handle` forever"""
+    while True:
+        item = await stage.queue.get()
+        try:
+            await handle(item)
+        except Exception as e:
+            logger.exception(f"{stage.name} failed on {item!r:.100}: {e}")
+        finally:
+            stage.done += 1
+            stage.queue.task_done()
+
+
+async def monitor(stages: list, interval: float) -> None:
+    """Logs queue depths and throughput of the stages every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(" | ".join(stage.report(interval) for stage in stages))
+
+
+async def fetch(url: str, scheduler: CrawlScheduler, cache: PageCache = None) -> str:
+    """Asynchronous GET request
     
     :param url: url to fetch
-    :param session: open aiohttp.ClientSession
+    :param scheduler: open CrawlScheduler
+    :param cache: optional PageCache
     """
+    if cache is not None:
+        html = await cache.fetch(url, scheduler)
+        logger.info(f"Got page for URL: {url}")
+        return html
+    async with scheduler.request("GET", url) as resp:
+        resp.raise_for_status()
+        logger.info(f"Got response [{resp.status}] for URL: {url}")
+        html = await resp.text()
+    return html
+
+async def fetch_page(url: str, scheduler: CrawlScheduler, cache: PageCache,
+                     parse_stage: Stage) -> None:
+    """Fetch stage: downloads the page and passes it to parsing"""
     try:
-        html = await fetch(url=url, session=session)
+        html = await fetch(url=url, scheduler=scheduler, cache=cache)
     except (
         aiohttp.ClientError,
         aiohttp.http_exceptions.HttpProcessingError,
@@ -55,36 +110,122 @@ async def parse(url: str, session: ClientSession) -> set:
             f"Non-aiohttp exception occured: {getattr(e, '__dict__', {})}")
         logger.info(f"No images to write URL: {url}") 
     else:
-        soup = BeautifulSoup(html, 'html.parser')
-        image_soups = soup.findAll('img')
-        logger.info(f"Found {len(image_soups)} images for {url}")
-        for i, img_soup in enumerate(image_soups):
-            if img_soup.get('src').startswith('/static'):
-                continue
-            try:
-                async with session.get('https:'+img_soup.get('src')) as resp:
-                    name = url.split('/')[-1] + f'_{img_soup.get("alt")}_{i}'
-                    async with aiofiles.open(f'images/{name}.png', 'wb') as f:
-                        await f.write(await resp.read())
-            except Exception as e:
-                logger.error(f'Error while parsing URL: {url}, message: {e}')
-    logger.info(f"Wrote results for source URL: {url}")   
+        await parse_stage.queue.put((url, html))
+
+def find_images(html: str, parser: str) -> list:
+    """Images of the page as (index, src, alt), runs in a worker process
+    
+    :param html: page
+    :param parser: BeautifulSoup parser, e.g. 'html.parser' or 'lxml'
+    """
+    soup = BeautifulSoup(html, parser)
+    return [(i, img.get('src'), img.get('alt'))
+            for i, img in enumerate(soup.find_all('img'))
+            if img.get('src') and not img.get('src').startswith('/static')]
+
+async def parse_page(page: tuple, executor: ProcessPoolExecutor, parser: str,
+                     download_stage: Stage) -> None:
+    """Parse stage: finds images of the page off the event loop"""
+    url, html = page
+    loop = asyncio.get_running_loop()
+    images = await loop.run_in_executor(executor, find_images, html, parser)
+    logger.info(f"Found {len(images)} images for {url}")
+    for i, src, alt in images:
+        name = url.split('/')[-1] + f'_{alt}_{i}'
+        await download_stage.queue.put((url, urljoin(url, src), name))
+
+async def download_image(image: tuple, scheduler: CrawlScheduler, store: ImageStore) -> None:
+    """Download stage: saves an image"""
+    url, src, name = image
+    try:
+        await store.save(src, f'{name}.png', scheduler)
+    except Exception as e:
+        logger.error(f'Error while parsing URL: {url}, message: {e}')
 
 @async_timeit
-async def main(urls: set) -> None:
+async def main(urls: set, fetchers: int = 4, parsers: int = 2,
+               downloaders: int = 16, queue_size: int = 100,
+               parser: str = 'html.parser', monitor_interval: float = 1.0,
+               images_dir: str = 'images', cache_dir: str = '.cache/pages',
+               **scheduler_kwargs) -> None:
     """Crawl and saves images from multiple wiki pages concurently
     
     :param urls: set of urls to crawl
+    :param fetchers: number of concurrent page fetches
+    :param parsers: number of parsing processes
+    :param downloaders: number of concurrent image downloads
+    :param queue_size: capacity of the queues between the stages
+    :param parser: BeautifulSoup parser
+    :param monitor_interval: seconds between the stage reports
+    :param images_dir: directory of the images
+    :param cache_dir: directory of the page cache, None disables it
+    :Keyword Arguments: arguments of CrawlScheduler
     """
-    async with ClientSession() as session:
-        tasks = [parse(url=url, session=session) for url in urls]
-        await asyncio.gather(*tasks)
+    fetch_stage = Stage('fetch', queue_size)
+    parse_stage = Stage('parse', queue_size)
+    download_stage = Stage('download', queue_size)
+    stages = [fetch_stage, parse_stage, download_stage]
+    store = ImageStore(images_dir)
+    cache = PageCache(cache_dir) if cache_dir is not None else None
+    start = time.perf_counter()
+    
+    with ProcessPoolExecutor(parsers) as executor:
+        async with CrawlScheduler(**scheduler_kwargs) as scheduler:
+            workers = [asyncio.create_task(worker(fetch_stage, functools.partial(
+                           fetch_page, scheduler=scheduler, cache=cache, parse_stage=parse_stage)))
+                       for _ in range(fetchers)]
+            workers += [asyncio.create_task(worker(parse_stage, functools.partial(
+                            parse_page, executor=executor, parser=parser,
+                            download_stage=download_stage)))
+                        for _ in range(parsers)]
+            workers += [asyncio.create_task(worker(download_stage, functools.partial(
+                            download_image, scheduler=scheduler, store=store)))
+                        for _ in range(downloaders)]
+            workers.append(asyncio.create_task(monitor(stages, monitor_interval)))
+            
+            try:
+                for url in urls:
+                    await fetch_stage.queue.put(url)
+                # every stage feeds the next one before marking its item done
+                for stage in stages:
+                    await stage.queue.join()
+            finally:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                store.save_index()
+            
+    elapsed = time.perf_counter() - start
+    for stage in stages:
+        logger.info(f"{stage.name}: {stage.done} done, {stage.done / elapsed:.1f}/s")
+    logger.info(store.report())
+    if cache is not None:
+        logger.info(cache.report())
+    logger.info(f"Crawl stats: {scheduler.stats.report()}")
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('urls_file', help='file with urls to crawl')
+    parser.add_argument('--concurrency', type=int, default=20, help='maximum requests in flight')
+    parser.add_argument('--per-host', type=int, default=4, help='maximum requests in flight per host')
+    parser.add_argument('--timeout', type=float, default=30, help='request timeout in seconds')
+    parser.add_argument('--retries', type=int, default=3, help='retries of failed requests')
+    parser.add_argument('--fetchers', type=int, default=4, help='concurrent page fetches')
+    parser.add_argument('--parsers', type=int, default=2, help='parsing processes')
+    parser.add_argument('--downloaders', type=int, default=16, help='concurrent image downloads')
+    parser.add_argument('--queue-size', type=int, default=100, help='capacity of the queues between stages')
+    parser.add_argument('--images-dir', default='images', help='directory of the images')
+    parser.add_argument('--cache-dir', default='.cache/pages', help='directory of the page cache')
+    parser.add_argument('--no-cache', action='store_true', help='do not cache the pages')
+    parser.add_argument('--parser', default='html.parser', choices=['html.parser', 'lxml', 'html5lib'],
+                        help='BeautifulSoup parser')
     args = parser.parse_args()
     with open(args.urls_file) as f:
         urls = set(map(str.strip, f))
-    asyncio.run(main(urls=urls))
\ No newline at end of file
+    asyncio.run(main(urls=urls, fetchers=args.fetchers, parsers=args.parsers,
+                     downloaders=args.downloaders, queue_size=args.queue_size,
+                     parser=args.parser, images_dir=args.images_dir,
+                     cache_dir=None if args.no_cache else args.cache_dir,
+                     concurrency=args.concurrency,
+                     per_host=args.per_host, timeout=args.timeout, retries=args.retries))
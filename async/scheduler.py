@@ -0,0 +1,147 @@
+"""
+Crawl scheduler with concurrency limits, connection pooling and retries
+"""
+import time
+import random
+import asyncio
+import logging
+import collections
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+
+logger = logging.getLogger('CrawlScheduler')
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CrawlStats:
+    """Counts of requests, retries and errors of a crawl"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.statuses = collections.Counter()
+
+    def record(self, status: int = None) -> None:
+        """Records an attempt, `status` is None for connection errors and timeouts"""
+        self.requests += 1
+        self.statuses[status] += 1
+        if status is None or status >= 400:
+            self.errors += 1
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        return (f"{self.requests} requests in {elapsed:.1f}s "
+                f"({self.requests / max(elapsed, 1e-9):.1f} req/s), "
+                f"error rate {self.errors / max(self.requests, 1):.1%}, "
+                f"{self.retries} retries, statuses {dict(self.statuses)}")
+
+
+class CrawlScheduler:
+    """Shared HTTP client of a crawler
+    
+    Limits the number of requests in flight globally and per host, reuses
+    keep-alive connections from a bounded pool and retries connection errors,
+    timeouts and 429/5xx responses with exponential backoff and full jitter,
+    honouring Retry-After. Slots are released while waiting for a retry.
+    
+        async with CrawlScheduler(concurrency=20, per_host=4) as scheduler:
+            async with scheduler.request("GET", url) as resp:
+                html = await resp.text()
+        print(scheduler.stats.report())
+    
+    :param concurrency: maximum number of requests in flight
+    :param per_host: maximum number of requests in flight to a single host
+    :param timeout: total timeout of a request in seconds
+    :param retries: maximum number of retries of a request
+    :param backoff: base delay of the retries in seconds, doubled every retry
+    :param max_backoff: maximum delay of a retry in seconds
+    :param keepalive: seconds an idle connection is kept open for reuse
+    """
+
+    def __init__(self, concurrency: int = 20, per_host: int = 4,
+                 timeout: float = 30, retries: int = 3, backoff: float = 0.5,
+                 max_backoff: float = 30, keepalive: float = 30):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.keepalive = keepalive
+        self.stats = CrawlStats()
+        self.session = None
+        self._slots = asyncio.Semaphore(concurrency)
+        self._host_slots = collections.defaultdict(lambda: asyncio.Semaphore(per_host))
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         limit_per_host=self.per_host,
+                                         keepalive_timeout=self.keepalive,
+                                         ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.stats = CrawlStats()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def _delay(self, attempt: int, retry_after: str = None) -> float:
+        """Delay before the retry after `attempt` failed attempts"""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                try:
+                    wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    wait = 0
+            delay = max(delay, min(wait, self.max_backoff))
+        return delay
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """Sends a request, retrying it if needed, yields the response
+        
+        The response of the last attempt is yielded also when it failed,
+        check its status. Connection errors and timeouts of the last attempt
+        are raised.
+        
+        :param method: HTTP method
+        :param url: url to request
+        :Keyword Arguments: arguments of aiohttp.ClientSession.request
+        """
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            # waiting for a busy host must not hold a global slot
+            async with self._host_slots[host], self._slots:
+                try:
+                    resp = await self.session.request(method, url, **kwargs)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    self.stats.record()
+                    if attempt == self.retries:
+                        raise
+                    delay = self._delay(attempt)
+                    reason = repr(e)
+                else:
+                    self.stats.record(resp.status)
+                    if resp.status not in RETRY_STATUSES or attempt == self.retries:
+                        try:
+                            yield resp
+                        finally:
+                            resp.release()
+                        return
+                    delay = self._delay(attempt, resp.headers.get("Retry-After"))
+                    reason = resp.status
+                    resp.release()
+            self.stats.retries += 1
+            logger.debug(f"Retrying {url} in {delay:.2f}s after {reason}")
+            await asyncio.sleep(delay)
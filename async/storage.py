@@ -0,0 +1,188 @@
+"""
+On-disk storage of the crawler: deduplicated images and cached pages
+"""
+import os
+import json
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+
+import aiofiles
+
+from scheduler import CrawlScheduler
+
+logger = logging.getLogger('CrawlStorage')
+
+
+def atomic_write_json(path: str, data) -> None:
+    tmp = f'{path}.{uuid.uuid4().hex}.part'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hardlinks `src` to `dst`, copies where links are not supported"""
+    tmp = f'{dst}.{uuid.uuid4().hex}.part'
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ImageStore:
+    """Directory of images deduplicated by url and content
+    
+    Images are streamed to a temporary file in chunks and renamed into place
+    once complete. Contents are kept once, under their sha256 in the `.blobs`
+    subdirectory, the image names are hardlinks to them (copies where links
+    are not supported) and are only ever replaced, never written into, so
+    the blobs stay intact. An index maps urls to content hashes, urls already
+    downloaded are not requested again. The same url requested concurrently
+    is downloaded once.
+    
+    :param root: directory of the images
+    :param chunk_size: size of the chunks written in bytes
+    """
+
+    def __init__(self, root: str = 'images', chunk_size: int = 1 << 16):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.blobs = os.path.join(root, '.blobs')
+        self.index_path = os.path.join(root, '.index.json')
+        self.urls = {}
+        self.downloaded = 0
+        self.linked = 0
+        self.skipped = 0
+        self.bytes = 0
+        self._inflight = {}
+        os.makedirs(self.blobs, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.urls = json.load(f)['urls']
+
+    def save_index(self) -> None:
+        atomic_write_json(self.index_path, {'urls': self.urls})
+
+    def _blob(self, digest: str) -> str:
+        return os.path.join(self.blobs, digest)
+
+    def _stored(self, url: str) -> bool:
+        """Whether the content of `url` is stored"""
+        digest = self.urls.get(url)
+        return digest is not None and os.path.exists(self._blob(digest))
+
+    def _place(self, digest: str, path: str) -> None:
+        """Makes `path` a name of the stored content `digest`"""
+        blob = self._blob(digest)
+        if os.path.exists(path) and os.path.samefile(blob, path):
+            self.skipped += 1
+        else:
+            link_or_copy(blob, path)
+            self.linked += 1
+
+    async def save(self, url: str, name: str, scheduler: CrawlScheduler) -> str:
+        """Stores the image at `url` as `name` in the directory
+        
+        :param url: url of the image
+        :param name: file name
+        :param scheduler: open CrawlScheduler
+        :returns: path of the image
+        """
+        path = os.path.join(self.root, name)
+        while url in self._inflight:
+            await asyncio.shield(self._inflight[url])
+        if self._stored(url):
+            self._place(self.urls[url], path)
+            return path
+        
+        self._inflight[url] = asyncio.get_running_loop().create_future()
+        tmp = os.path.join(self.blobs, f'{uuid.uuid4().hex}.part')
+        try:
+            sha = hashlib.sha256()
+            async with scheduler.request("GET", url) as resp:
+                resp.raise_for_status()
+                async with aiofiles.open(tmp, 'wb') as f:
+                    async for chunk in resp.content.iter_chunked(self.chunk_size):
+                        sha.update(chunk)
+                        self.bytes += len(chunk)
+                        await f.write(chunk)
+            digest = sha.hexdigest()
+            self.downloaded += 1
+            if os.path.exists(self._blob(digest)):
+                os.remove(tmp)
+            else:
+                os.replace(tmp, self._blob(digest))
+            self.urls[url] = digest
+            self._place(digest, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self._inflight.pop(url).set_result(None)
+        return path
+
+    def report(self) -> str:
+        return (f"images: {self.downloaded} downloaded ({self.bytes / 2**20:.1f} MiB), "
+                f"{self.linked} linked, {self.skipped} already stored")
+
+
+class PageCache:
+    """On-disk HTTP cache of pages revalidated with conditional requests
+    
+    Every page is stored with its ETag and Last-Modified headers, which are
+    sent back as If-None-Match and If-Modified-Since, an unchanged page is
+    then answered by 304 without a body and read from the disk.
+    
+    :param root: directory of the cache
+    """
+
+    def __init__(self, root: str = '.cache/pages'):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(url.encode()).hexdigest())
+
+    async def fetch(self, url: str, scheduler: CrawlScheduler) -> str:
+        """Text of the page at `url`, from the cache if unchanged
+        
+        :param url: url of the page
+        :param scheduler: open CrawlScheduler
+        """
+        path = self._path(url)
+        headers = {}
+        if os.path.exists(path + '.json') and os.path.exists(path + '.html'):
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+                
+        async with scheduler.request("GET", url, headers=headers) as resp:
+            resp.raise_for_status()
+            if resp.status == 304 and headers:
+                self.hits += 1
+                async with aiofiles.open(path + '.html', encoding='utf-8') as f:
+                    return await f.read()
+            html = await resp.text()
+            etag = resp.headers.get('ETag')
+            last_modified = resp.headers.get('Last-Modified')
+        
+        self.misses += 1
+        if etag or last_modified:
+            tmp = f'{path}.{uuid.uuid4().hex}.part'
+            async with aiofiles.open(tmp, 'w', encoding='utf-8') as f:
+                await f.write(html)
+            os.replace(tmp, path + '.html')
+            atomic_write_json(path + '.json', {'url': url, 'etag': etag,
+                                               'last_modified': last_modified})
+        return html
+
+    def report(self) -> str:
+        return f"pages: {self.hits} not modified, {self.misses} downloaded"
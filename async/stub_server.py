@@ -0,0 +1,96 @@
+"""
+Local stand-in for Wikipedia to test the crawler against
+
+Serves generated pages under /wiki/<name> linking to images under /img/,
+with random latency and a share of 429/503 errors. Pages support
+conditional requests (ETag and Last-Modified), /stats counts the requests
+and bytes sent:
+
+    python stub_server.py --port 8080 --latency 0.05 --error-rate 0.1
+    python async_request.py urls_stub.txt
+
+where urls_stub.txt lists e.g. http://127.0.0.1:8080/wiki/Page_1
+"""
+import random
+import asyncio
+import hashlib
+from email.utils import formatdate
+
+from aiohttp import web
+
+
+def make_app(latency: float = 0.05, error_rate: float = 0.1,
+             images_per_page: int = 10, shared_images: int = 5,
+             image_size: int = 20000) -> web.Application:
+    """Stand-in server
+    
+    :param latency: maximum random delay of a response in seconds
+    :param error_rate: share of responses failing with 429 or 503
+    :param images_per_page: number of images on a page
+    :param shared_images: number of images (logos, icons) shared by all pages
+    :param image_size: size of an image in bytes
+    """
+
+    @web.middleware
+    async def chaos(request, handler):
+        if request.path == '/stats':
+            return await handler(request)
+        await asyncio.sleep(random.uniform(0, latency))
+        request.app['requests'] += 1
+        if random.random() < error_rate:
+            request.app['errors'] += 1
+            if random.random() < 0.5:
+                return web.Response(status=429, headers={'Retry-After': '0'})
+            return web.Response(status=503)
+        resp = await handler(request)
+        request.app['bytes'] += len(resp.body or b'')
+        return resp
+
+    last_modified = formatdate(usegmt=True)
+
+    async def page(request):
+        name = request.match_info['name']
+        images = [f'shared_{i}' for i in range(shared_images)]
+        images += [f'{name}_{i}' for i in range(images_per_page - shared_images)]
+        imgs = '\n'.join(f'<img src="//{request.host}/img/{img}.png" alt="{img}">'
+                         for img in images)
+        body = f'<html><body><h1>{name}</h1>\n{imgs}\n<p>{"lorem ipsum " * 500}</p></body></html>'
+        etag = '"{}"'.format(hashlib.sha1(body.encode()).hexdigest())
+        headers = {'ETag': etag, 'Last-Modified': last_modified}
+        if_none_match = request.headers.get('If-None-Match')
+        if (if_none_match == etag if if_none_match is not None
+                else request.headers.get('If-Modified-Since') == last_modified):
+            return web.Response(status=304, headers=headers)
+        return web.Response(text=body, content_type='text/html', headers=headers)
+
+    async def image(request):
+        seed = hashlib.sha1(request.match_info['name'].encode()).digest()
+        data = (seed * (image_size // len(seed) + 1))[:image_size]
+        return web.Response(body=data, content_type='image/png')
+
+    async def stats(request):
+        return web.json_response({'requests': request.app['requests'],
+                                  'errors': request.app['errors'],
+                                  'bytes': request.app['bytes']})
+
+    app = web.Application(middlewares=[chaos])
+    app['requests'] = 0
+    app['errors'] = 0
+    app['bytes'] = 0
+    app.add_routes([web.get('/wiki/{name}', page),
+                    web.get('/img/{name}.png', image),
+                    web.get('/stats', stats)])
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.05, help='maximum delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='share of failed responses')
+    parser.add_argument('--images', type=int, default=10, help='images per page')
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.error_rate, args.images),
+                host='127.0.0.1', port=args.port)
@@ -1,11 +1,20 @@
 """
 Script visualizing bias-variance tradeoff
+
+    python bias_var.py              # render figures to LR/ and Tree/
+    python bias_var.py --data-only  # only save the arrays to data.npz
 """
+import os
+import json
+import hashlib
+import argparse
+import multiprocessing
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
+from matplotlib.collections import LineCollection
 from sklearn.tree import DecisionTreeRegressor
-from sklearn.metrics import mean_squared_error as mse
 
 
 LR_FOLDER = 'LR/'
@@ -17,6 +26,10 @@ NOISE_VARIANCE = 0.5
 MAX_POLY = 12
 N = 25
 Ntrain = int(0.9*N)
+BLOCK_SIZE = 1000
+NUM_CURVES = 50
+# bump when the figures change, so that they are rendered again
+RENDER_VERSION = 1
 
 np.random.seed(42)
 
@@ -39,61 +52,227 @@ def true_f(x):
     return np.sin(x)
 
 
-def plot_prediction_curves(x_axis, prediction_curves, param, folder):
-    """Plot and save all prediction curves for all model complexities
+class BiasVariance(object):
+    """Streaming bias-variance decomposition over datasets
+    
+    Keeps running means and variances (Welford, merged block by block) of
+    the predictions at every point and model complexity, and the sums of
+    squared errors, so the memory does not depend on the number of datasets.
+    
+    :param f: ground truth at the points, shape (points,)
+    :param n_models: number of model complexities
+    """
+    
+    def __init__(self, f, n_models):
+        self.f = f
+        self.n = 0
+        self.mean = np.zeros((len(f), n_models))
+        self.m2 = np.zeros((len(f), n_models))
+        self.sse = np.zeros((len(f), n_models))
+        
+    def update(self, predictions, Y=None):
+        """Adds predictions of a block of datasets
+        
+        :param predictions: shape (points, datasets, n_models)
+        :param Y: targets of the datasets, shape (points, datasets)
+        """
+        k = predictions.shape[1]
+        mean_block = predictions.mean(axis=1)
+        m2_block = ((predictions - mean_block[:,None])**2).sum(axis=1)
+        n = self.n + k
+        delta = mean_block - self.mean
+        self.mean += delta * k / n
+        self.m2 += m2_block + delta**2 * self.n * k / n
+        self.n = n
+        if Y is not None:
+            self.sse += ((predictions - Y[:,:,None])**2).sum(axis=1)
+            
+    def squared_bias(self, points=slice(None)):
+        return ((self.mean[points] - self.f[points,None])**2).mean(axis=0)
+    
+    def variance(self, points=slice(None)):
+        return (self.m2[points] / self.n).mean(axis=0)
+    
+    def score(self, points=slice(None)):
+        """Average MSE over datasets"""
+        return (self.sse[points] / self.n).mean(axis=0)
+
+
+def fit_lr(Xpoly, x_axis_poly, Y):
+    """Polynomial regressions of a block of datasets for all degrees
+    
+    Design matrices are shared by all datasets, so every degree is solved
+    as one least squares problem with a target column per dataset.
+    
+    :param Xpoly: polynomials of the sample up to MAX_POLY degree, shape (N, MAX_POLY+1)
+    :param x_axis_poly: polynomials of the plotting axis, shape (len(x_axis), MAX_POLY+1)
+    :param Y: targets of the datasets, shape (N, datasets)
+    :returns: predictions (N, datasets, MAX_POLY)
+        and prediction curves (len(x_axis), datasets, MAX_POLY)
     """
+    num_datasets = Y.shape[1]
+    predictions = np.zeros((N, num_datasets, MAX_POLY))
+    prediction_curves = np.zeros((len(x_axis_poly), num_datasets, MAX_POLY))
+    
     for d in range(MAX_POLY):
-        for k in range(NUM_DATASETS):
-            plt.plot(x_axis, prediction_curves[:,k,d], color="green", alpha=0.5)
-        plt.plot(x_axis, prediction_curves[:,:,d].mean(axis=1), color="blue", linewidth=2.0, label='average prediction')
-        plt.plot(x_axis, true_f(x_axis), color="orange", label='ground truth')
-        plt.title(f"All prediction curves for {param} = %d" % (d+1))
-        plt.legend()
-        plt.savefig(folder+f'/curves{d}.png')
-        plt.close()
+        # constant column makes the intercept
+        W = np.linalg.lstsq(Xpoly[:Ntrain,:d+2], Y[:Ntrain], rcond=None)[0]
+        predictions[:,:,d] = Xpoly[:,:d+2] @ W
+        prediction_curves[:,:,d] = x_axis_poly[:,:d+2] @ W
+    return predictions, prediction_curves
+
+
+def predict_depths(tree, x, max_depth):
+    """Predictions of a tree cut off at every depth 1..max_depth
+    
+    A tree of smaller max_depth is a prefix of the deeper one, the prediction
+    of a cut off tree is the mean stored in the node the sample reaches at
+    the cutoff depth (or in its leaf if it is shallower).
     
+    :returns: np.ndarray of shape (len(x), max_depth)
+    """
+    paths = tree.decision_path(x.reshape(-1, 1))
+    # children have larger node ids than parents, so sorted ids follow the path
+    paths.sort_indices()
+    lenghts = np.diff(paths.indptr)
+    depths = np.arange(1, max_depth+1)
+    nodes = paths.indices[paths.indptr[:-1,None] + np.minimum(depths, lenghts[:,None]-1)]
+    return tree.tree_.value[nodes,0,0]
 
-def plot_bias_variance_tradeoff(X, train_predictions, train_scores, test_scores, folder):
-    """Plot and save train vs test scores and bias-variance decomposition
+
+def fit_tree(x, x_axis, Y):
+    """Regression trees of a block of datasets for all depths
+    
+    One tree of MAX_POLY depth is fit per dataset, the shallower ones are
+    obtained by cutting it off, see `predict_depths`.
+    
+    :param x: sample, shape (N,)
+    :param x_axis: plotting axis
+    :param Y: targets of the datasets, shape (N, datasets)
+    :returns: predictions (N, datasets, MAX_POLY)
+        and prediction curves (len(x_axis), datasets, MAX_POLY)
+    """
+    num_datasets = Y.shape[1]
+    predictions = np.zeros((N, num_datasets, MAX_POLY))
+    prediction_curves = np.zeros((len(x_axis), num_datasets, MAX_POLY))
+    
+    tree = DecisionTreeRegressor(max_depth=MAX_POLY)
+    for k in range(num_datasets):
+        tree.fit(x[:Ntrain].reshape(-1, 1), Y[:Ntrain,k])
+        predictions[:,k] = predict_depths(tree, x, MAX_POLY)
+        prediction_curves[:,k] = predict_depths(tree, x_axis, MAX_POLY)
+    return predictions, prediction_curves
+
+
+def summarize(decomposition):
+    """Scores and bias-variance decomposition per model complexity
+    
+    The decomposition is evaluated on the test points, where
+    squared bias + variance + noise estimates the test score.
     """
-    average_train_prediction = np.zeros((Ntrain, MAX_POLY))
-    squared_bias = np.zeros(MAX_POLY)
-    f_Xtrain = true_f(X)[:Ntrain]
+    test = slice(Ntrain, None)
+    return {"train_score": decomposition.score(slice(None, Ntrain)),
+            "test_score": decomposition.score(test),
+            "squared_bias": decomposition.squared_bias(test),
+            "variance": decomposition.variance(test),
+            "noise": np.full(MAX_POLY, NOISE_VARIANCE**2)}
+
+
+def print_summary(summary, folder):
+    print(folder)
+    print("{:>10}{:>12}{:>16}".format("complexity", "test score", "bias+var+noise"))
     for d in range(MAX_POLY):
-        for i in range(Ntrain):
-            average_train_prediction[i,d] = train_predictions[i,:,d].mean()
-        squared_bias[d] = ((average_train_prediction[:,d] - f_Xtrain)**2).mean()
-        
-    variances = np.zeros((Ntrain, MAX_POLY))
+        print("{:>10}{:>12.4f}{:>16.4f}".format(d+1, summary["test_score"][d],
+              summary["squared_bias"][d] + summary["variance"][d] + summary["noise"][d]))
+
+
+def digest(*inputs):
+    """Hash of the inputs of a figure"""
+    h = hashlib.sha1(str(RENDER_VERSION).encode())
+    for x in inputs:
+        h.update(np.ascontiguousarray(x).tobytes() if isinstance(x, np.ndarray) else str(x).encode())
+    return h.hexdigest()
+
+
+def plot_prediction_curves(x_axis, prediction_curves, average_curves, param, folder, hashes):
+    """Plot and save prediction curves for all model complexities
+    
+    Curves of all datasets are drawn as one LineCollection. Figures whose
+    inputs hash to the value in `hashes` are not rendered again.
+    
+    :param prediction_curves: curves of the first NUM_CURVES datasets
+    :param average_curves: average curves over all datasets
+    """
     for d in range(MAX_POLY):
-        for i in range(Ntrain):
-            delta = train_predictions[i, :, d] - average_train_prediction[i,d]
-            variances[i,d] = delta.dot(delta) / N
-        variance = variances.mean(axis=0)
-        
+        name = f'curves{d}.png'
+        key = digest(x_axis, prediction_curves[:,:,d], average_curves[:,d], param)
+        if hashes.get(name) == key and os.path.exists(os.path.join(folder, name)):
+            continue
+        fig, ax = plt.subplots()
+        segments = np.stack(np.broadcast_arrays(x_axis[None,:], prediction_curves[:,:,d].T), axis=-1)
+        ax.add_collection(LineCollection(segments, colors="green", alpha=0.5))
+        ax.plot(x_axis, average_curves[:,d], color="blue", linewidth=2.0, label='average prediction')
+        ax.plot(x_axis, true_f(x_axis), color="orange", label='ground truth')
+        ax.set_title(f"All prediction curves for {param} = %d" % (d+1))
+        ax.legend()
+        fig.savefig(os.path.join(folder, name))
+        plt.close(fig)
+        hashes[name] = key
+    
+
+def plot_bias_variance_tradeoff(summary, folder, hashes):
+    """Plot and save train vs test scores and bias-variance decomposition
+    """
+    key = digest(*[summary[k] for k in sorted(summary)])
+    if (hashes.get('bias_var.png') == key and os.path.exists(os.path.join(folder, 'bias_var.png'))
+            and os.path.exists(os.path.join(folder, 'train_test.png'))):
+        return
     degrees = np.arange(MAX_POLY) + 1
-    best_degree = np.argmin(test_scores.mean(axis=0)) + 1
-        
-    plt.plot(degrees, train_scores.mean(axis=0), label="train score")
-    plt.plot(degrees, test_scores.mean(axis=0), label="test score")
-    plt.axvline(x=best_degree, label= "best coplexity", color="black")
-    plt.legend()
-    plt.savefig(folder+'train_test.png')
-    plt.close()
-    
-    plt.plot(degrees, squared_bias, label = "squared bias")
-    plt.plot(degrees, variance, label = "variance")
-    plt.plot(degrees, test_scores.mean(axis=0), label="test score")
-    plt.plot(degrees, squared_bias+variance, label="squared bias + variance")
-    plt.axvline(x=best_degree, label= "best coplexity", color="black")
-    plt.xlabel("Degree")
-    plt.ylabel("Average score (MSE)")
-    plt.legend()
-    plt.savefig(folder+'bias_var.png')
-    plt.close()
-    
-    
-def main():
+    test_score = summary["test_score"]
+    best_degree = np.argmin(test_score) + 1
+    
+    fig, ax = plt.subplots()
+    ax.plot(degrees, summary["train_score"], label="train score")
+    ax.plot(degrees, test_score, label="test score")
+    ax.axvline(x=best_degree, label= "best coplexity", color="black")
+    ax.legend()
+    fig.savefig(os.path.join(folder, 'train_test.png'))
+    plt.close(fig)
+    
+    fig, ax = plt.subplots()
+    ax.plot(degrees, summary["squared_bias"], label = "squared bias")
+    ax.plot(degrees, summary["variance"], label = "variance")
+    ax.plot(degrees, summary["noise"], label="noise", color="gray", linestyle="--")
+    ax.plot(degrees, test_score, label="test score")
+    ax.plot(degrees, summary["squared_bias"] + summary["variance"] + summary["noise"],
+            label="squared bias + variance + noise")
+    ax.axvline(x=best_degree, label= "best coplexity", color="black")
+    ax.set_xlabel("Degree")
+    ax.set_ylabel("Average score (MSE)")
+    ax.legend()
+    fig.savefig(os.path.join(folder, 'bias_var.png'))
+    plt.close(fig)
+    hashes['bias_var.png'] = key
+
+
+def render(x_axis, prediction_curves, average_curves, summary, param, folder):
+    """Renders all figures of one model, skipping the unchanged ones
+    
+    Hashes of the figure inputs are kept in a `figures.json` sidecar.
+    """
+    os.makedirs(folder, exist_ok=True)
+    sidecar = os.path.join(folder, 'figures.json')
+    hashes = {}
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            hashes = json.load(f)
+    plot_prediction_curves(x_axis, prediction_curves, average_curves, param, folder, hashes)
+    plot_bias_variance_tradeoff(summary, folder, hashes)
+    with open(sidecar, 'w') as f:
+        json.dump(hashes, f, indent=2)
+    
+    
+def main(data_only=False):
     x_axis = np.linspace(-np.pi, np.pi, 100)
     
     X = np.linspace(-np.pi, np.pi, N)
@@ -101,71 +280,49 @@ def main():
     f_X = true_f(X)
     
     Xpoly = make_poly(X, MAX_POLY)
+    x_axis_poly = make_poly(x_axis, MAX_POLY)
     
-    train_scores_lr = np.zeros((NUM_DATASETS, MAX_POLY))
-    test_scores_lr = np.zeros((NUM_DATASETS, MAX_POLY))
-    train_predictions_lr = np.zeros((Ntrain, NUM_DATASETS, MAX_POLY))
-    prediction_curves_lr = np.zeros((100, NUM_DATASETS, MAX_POLY))
+    decomposition_lr = BiasVariance(f_X, MAX_POLY)
+    decomposition_dt = BiasVariance(f_X, MAX_POLY)
+    average_curves_lr = BiasVariance(true_f(x_axis), MAX_POLY)
+    average_curves_dt = BiasVariance(true_f(x_axis), MAX_POLY)
     
-    train_scores_dt = np.zeros((NUM_DATASETS, MAX_POLY))
-    test_scores_dt = np.zeros((NUM_DATASETS, MAX_POLY))
-    train_predictions_dt = np.zeros((Ntrain, NUM_DATASETS, MAX_POLY))
-    prediction_curves_dt = np.zeros((100, NUM_DATASETS, MAX_POLY))
-    
-    lr = LinearRegression()
-    
-    for k in range(NUM_DATASETS):
-        Y = f_X + np.random.randn(N)*NOISE_VARIANCE
+    for start in range(0, NUM_DATASETS, BLOCK_SIZE):
+        num_datasets = min(BLOCK_SIZE, NUM_DATASETS - start)
+        Y = f_X[:,None] + np.random.randn(num_datasets, N).T*NOISE_VARIANCE
         
-        Xtrain = Xpoly[:Ntrain]
-        Ytrain = Y[:Ntrain]
+        predictions_lr, curves_lr = fit_lr(Xpoly, x_axis_poly, Y)
+        decomposition_lr.update(predictions_lr, Y)
+        average_curves_lr.update(curves_lr)
         
-        Xtest = Xpoly[Ntrain:]
-        Ytest = Y[Ntrain:]
+        predictions_dt, curves_dt = fit_tree(X, x_axis, Y)
+        decomposition_dt.update(predictions_dt, Y)
+        average_curves_dt.update(curves_dt)
         
-        for d in range(MAX_POLY):
-            lr.fit(Xtrain[:,:d+2],Ytrain)
-            predictions_lr = lr.predict(Xpoly[:,:d+2])
-            
-            x_axis_poly = make_poly(x_axis, d+1)
-            prediction_axis = lr.predict(x_axis_poly)
-            
-            prediction_curves_lr[:, k, d] = prediction_axis
-            train_prediction_lr = predictions_lr[:Ntrain]
-            test_prediction_lr = predictions_lr[Ntrain:]
-            
-            train_predictions_lr[:,k,d] = train_prediction_lr
-            
-            train_score_lr = mse(train_prediction_lr, Ytrain)
-            test_score_lr = mse(test_prediction_lr, Ytest)
-            
-            train_scores_lr[k,d] = train_score_lr
-            test_scores_lr[k,d] = test_score_lr
-			
-        for d in range(MAX_POLY):
-            tree = DecisionTreeRegressor(max_depth=d+1)
-            tree.fit(Xtrain[:,1].reshape(-1, 1) ,Ytrain)
-            prediction_axis = tree.predict(x_axis.reshape(-1, 1))
-            predictions_dt = tree.predict(Xpoly[:,1].reshape(-1, 1))
-            
-            prediction_curves_dt[:, k, d] = prediction_axis
-            train_prediction_dt = predictions_dt[:Ntrain]
-            test_prediction_dt = predictions_dt[Ntrain:]
-            
-            train_predictions_dt[:,k,d] = train_prediction_dt
-            
-            train_score_dt = mse(train_prediction_dt, Ytrain)
-            test_score_dt = mse(test_prediction_dt, Ytest)
-            
-            train_scores_dt[k,d] = train_score_dt
-            test_scores_dt[k,d] = test_score_dt
-			
+        if start == 0:
+            prediction_curves_lr = curves_lr[:,:NUM_CURVES]
+            prediction_curves_dt = curves_dt[:,:NUM_CURVES]
             
-    plot_prediction_curves(x_axis, prediction_curves_lr, 'degree', LR_FOLDER)
-    plot_bias_variance_tradeoff(X, train_predictions_lr, train_scores_lr, test_scores_lr, LR_FOLDER)
+    summary_lr = summarize(decomposition_lr)
+    summary_dt = summarize(decomposition_dt)
+    print_summary(summary_lr, LR_FOLDER)
+    print_summary(summary_dt, TREE_FOLDER)
     
-    plot_prediction_curves(x_axis, prediction_curves_dt, 'max_depth', TREE_FOLDER)
-    plot_bias_variance_tradeoff(X, train_predictions_dt, train_scores_dt, test_scores_dt, TREE_FOLDER)
+    figures = [(x_axis, prediction_curves_lr, average_curves_lr.mean, summary_lr, 'degree', LR_FOLDER),
+               (x_axis, prediction_curves_dt, average_curves_dt.mean, summary_dt, 'max_depth', TREE_FOLDER)]
+    if data_only:
+        for x_axis, prediction_curves, average_curves, summary, param, folder in figures:
+            os.makedirs(folder, exist_ok=True)
+            np.savez(os.path.join(folder, 'data.npz'), x_axis=x_axis,
+                     prediction_curves=prediction_curves,
+                     average_curves=average_curves, **summary)
+    else:
+        with multiprocessing.Pool(len(figures)) as pool:
+            pool.starmap(render, figures)
     
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-only', action='store_true',
+                        help='save curves and scores to data.npz instead of plotting')
+    main(parser.parse_args().data_only)
@@ -0,0 +1,199 @@
+"""
+Benchmark and regression suite for Hangman players and game engines
+
+Every player plays the same fixed sample of secret words with fixed seeds.
+Measured are games/sec, per-guess latency percentiles and peak memory,
+for batchable players also on the BatchHangmanGame engine. After a warm-up
+run every benchmark is repeated at least --repeats times and for at least
+--min-time seconds. Each repeat is timed against a fixed reference workload
+run just before it, baselines are compared on this relative throughput, so
+that drifts of the machine speed are not reported as regressions. Results
+can be saved as a JSON baseline and later runs compared against it:
+
+    python hangman_benchmark.py --save baseline.json
+    python hangman_benchmark.py --compare baseline.json --threshold 0.2
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+import numpy as np
+
+from Hangman import (UniRandomPlayer, LetterFreqPlayer, RandomFreqPlayer,
+                     CombFreqPlayer, BrutePlayer, SmartPlayer, BatchHangmanGame,
+                     PolicyCache, get_word_index, loadWords)
+
+
+PLAYERS = [UniRandomPlayer, LetterFreqPlayer, RandomFreqPlayer,
+           CombFreqPlayer, BrutePlayer, SmartPlayer]
+MEMORY_GAMES = 200
+REPEATS = 5
+MIN_TIME = 1.0
+
+
+def word_sample(wordlist, num_games, seed):
+    """Fixed sample of secret words"""
+    rng = np.random.default_rng(seed)
+    return [wordlist[i] for i in rng.integers(len(wordlist), size=num_games)]
+
+
+def reset(seed):
+    """Same starting state for every player"""
+    random.seed(seed)
+    np.random.seed(seed)
+    BrutePlayer.policy = PolicyCache()
+
+
+def play_serial(player, wordlist, sample, latencies=None):
+    for word in sample:
+        player.set_game(wordlist, secretWord=word)
+        while player.game.get_result() is None:
+            t0 = time.perf_counter()
+            player.guess()
+            if latencies is not None:
+                latencies.append(time.perf_counter() - t0)
+        player.results.append(player.game.get_result())
+
+
+def play_batch(player, wordlist, sample, latencies=None, seed=0):
+    games = BatchHangmanGame(sample, rng=np.random.default_rng(seed))
+    while games.get_active().any():
+        t0 = time.perf_counter()
+        games.update(player.guess_batch(games))
+        if latencies is not None:
+            # one step makes a guess in every game of the batch
+            latencies.append((time.perf_counter() - t0) / len(games))
+    player.results.extend(games.result.tolist())
+
+
+def peak_memory(play, player, wordlist, sample):
+    tracemalloc.start()
+    play(player, wordlist, sample)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def calibrate():
+    """Duration of a fixed reference workload, tracks the current machine speed"""
+    t0 = time.perf_counter()
+    total = 0
+    for i in range(200000):
+        total += i % 7
+    np.sort(np.random.default_rng(0).random(200000))
+    return time.perf_counter() - t0
+
+
+def measure(make_player, play, wordlist, sample, seed, repeats=REPEATS, min_time=MIN_TIME):
+    """Throughput of at least `repeats` runs taking `min_time` seconds in total
+    
+    Every run is preceded by the reference workload of `calibrate`.
+    "games_per_sec" is the best run, "games_per_ref" the median number of
+    games played in the time of the reference workload, which compares
+    across runs on a machine whose speed drifts.
+    """
+    reset(seed)
+    play(make_player(), wordlist, sample)
+    durations = []
+    relative = []
+    latencies = []
+    while len(durations) < repeats or sum(durations) < min_time:
+        reference = calibrate()
+        reset(seed)
+        player = make_player()
+        t0 = time.perf_counter()
+        play(player, wordlist, sample, latencies)
+        durations.append(time.perf_counter() - t0)
+        relative.append(len(sample) * reference / durations[-1])
+    reset(seed)
+    peak = peak_memory(play, make_player(), wordlist, sample[:MEMORY_GAMES])
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e6
+    return {"games_per_sec": len(sample) / min(durations),
+            "games_per_ref": float(np.median(relative)),
+            "repeats": len(durations),
+            "latency_p50_us": p50,
+            "latency_p90_us": p90,
+            "latency_p99_us": p99,
+            "peak_memory_kib": peak / 1024,
+            "score": player.get_score()}
+
+
+def run(wordlist, num_games, seed, players=PLAYERS, repeats=REPEATS, min_time=MIN_TIME):
+    """Runs the benchmark, returns {benchmark name: measurements}"""
+    sample = word_sample(wordlist, num_games, seed)
+    get_word_index(wordlist)
+    results = {}
+    for cls in players:
+        name = str(cls())
+        results[name] = measure(cls, play_serial, wordlist, sample, seed, repeats, min_time)
+        if cls.batchable:
+            results[name + " [batch]"] = measure(cls, play_batch, wordlist, sample, seed,
+                                                 repeats, min_time)
+    return results
+
+
+def report(results, baseline=None, threshold=0.2):
+    """Prints the results, returns names of benchmarks slower than baseline"""
+    print("")
+    print("{:<28}{:>12}{:>10}{:>10}{:>10}{:>12}{:>8}".format(
+        "benchmark", "games/sec", "p50 us", "p90 us", "p99 us", "peak KiB", "score"))
+    regressions = []
+    for name, r in results.items():
+        line = "{:<28}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>12.1f}{:>8.3f}".format(
+            name, r["games_per_sec"], r["latency_p50_us"], r["latency_p90_us"],
+            r["latency_p99_us"], r["peak_memory_kib"], r["score"])
+        if baseline is not None and "games_per_ref" in baseline.get(name, {}):
+            change = r["games_per_ref"] / baseline[name]["games_per_ref"] - 1
+            line += "  {:+.1%}".format(change)
+            if change < -threshold:
+                line += "  SLOWER"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=500, help='games per player')
+    parser.add_argument('--seed', type=int, default=42, help='seed of word sample and players')
+    parser.add_argument('--save', help='write results to this baseline file')
+    parser.add_argument('--compare', help='baseline file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='flag slowdowns of games/sec larger than this fraction')
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='minimum timed runs per benchmark')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME,
+                        help='minimum total seconds of timed runs per benchmark')
+    args = parser.parse_args()
+
+    wordlist = loadWords()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if (saved["meta"]["games"], saved["meta"]["seed"]) != (args.games, args.seed):
+            print("Warning: baseline was run with --games %i --seed %i"
+                  %(saved["meta"]["games"], saved["meta"]["seed"]))
+        baseline = saved["results"]
+
+    results = run(wordlist, args.games, args.seed, repeats=args.repeats, min_time=args.min_time)
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        meta = {"games": args.games, "seed": args.seed,
+                "python": platform.python_version(), "numpy": np.__version__,
+                "machine": platform.machine()}
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    if regressions:
+        print("")
+        print("Slower than baseline by more than %.0f%%: %s" %(args.threshold*100, ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,110 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import inspect
 import datetime
+import warnings
+import tempfile
+import functools
+import joblib
 import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.pipeline import Pipeline
-from joblib import Parallel, delayed
+from sklearn.model_selection import train_test_split, ParameterGrid
+from sklearn.base import clone
+from joblib import Parallel, delayed, effective_n_jobs
+
+
+def _take(X, idx):
+    """Rows `idx` of an array, sparse matrix, DataFrame/Series or list"""
+    if hasattr(X, "iloc"):
+        return X.iloc[idx]
+    if isinstance(X, list):
+        return [X[i] for i in idx]
+    return X[idx]
+
+
+def _generator_key(generator):
+    """Identity of a data generator for the dataset cache
+    
+    Plain functions are identified by their module and qualified name,
+    partials by the wrapped function and the bound arguments, closures
+    also by a hash of their code and of the contents of their cells.
+    
+    :raises ValueError: for lambdas, local functions without a closure and
+        other callables, which need an explicit `cache_key`
+    """
+    if isinstance(generator, functools.partial):
+        return "{}({})".format(_generator_key(generator.func),
+                               joblib.hash((generator.args, generator.keywords)))
+    if not inspect.isfunction(generator):
+        raise ValueError("Pass cache_key to cache data of {!r}".format(generator))
+    name = "{}.{}".format(generator.__module__, generator.__qualname__)
+    if generator.__closure__:
+        cells = [cell.cell_contents for cell in generator.__closure__]
+        code = generator.__code__
+        return "{}[{}]".format(name, joblib.hash((code.co_code, code.co_consts, cells)))
+    if "<lambda>" in name or "<locals>" in name:
+        raise ValueError("Pass cache_key to cache data of {}".format(name))
+    return name
+
+
+class RunningStats(object):
+    """Running mean and variance of several metrics
+    
+    Blocks of observations are merged with the parallel version of the
+    Welford algorithm (Chan et al.), so only O(n_metrics) numbers are kept.
+    
+    :param n_metrics: number of metrics (columns of the blocks)
+    """
+    
+    def __init__(self, n_metrics):
+        self.n = 0
+        self.mean = np.zeros(n_metrics)
+        self.m2 = np.zeros(n_metrics)
+        
+    def update(self, block):
+        """Adds a block of observations of shape (n_rounds, n_metrics)"""
+        block = np.atleast_2d(block)
+        n_block = len(block)
+        mean_block = block.mean(axis=0)
+        m2_block = ((block - mean_block)**2).sum(axis=0)
+        n = self.n + n_block
+        delta = mean_block - self.mean
+        self.mean = self.mean + delta * n_block / n
+        self.m2 = self.m2 + m2_block + delta**2 * self.n * n_block / n
+        self.n = n
+        
+    def variance(self):
+        return self.m2 / max(self.n - 1, 1)
+        
+    def ci_halfwidth(self, z=1.96):
+        """Half width of the normal confidence interval of the means"""
+        return z * np.sqrt(self.variance() / max(self.n, 1))
+
+
+class PhaseTimer(object):
+    """Adds the wall time since the previous lap to a phase of one round
+    
+    :param out: array of the phase times of the round, one per phase
+    """
+    
+    def __init__(self, out):
+        self.out = out
+        self.last = time.perf_counter()
+        
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.out[phase] += now - self.last
+        self.last = now
+
+
+class NoTimer(object):
+    """Stand-in of PhaseTimer when timing is disabled"""
+    
+    def lap(self, phase):
+        pass
 
 
 class TargetLeakageSimulation(object):
@@ -23,56 +125,183 @@ class TargetLeakageSimulation(object):
     :param transformer: sklearn transformer
     :param estimator: sklearn estimator
     :param data_generator: callable returning data as a tuple (X, y)
+    :param cache_dir: optional directory caching the generated datasets
+        keyed by generator, its arguments and the round seed; simulations
+        sharing the directory and seed reuse the data instead of regenerating
+        them (changes of the code of module level generators are not detected)
+    :param cache_key: identity of the generator in the cache, required for
+        lambdas and other generators `_generator_key` can not identify
+    :param timing: whether to measure the time spent in each phase of the
+        rounds (see PHASES), kept in `timings_` and reported
     """
+    
+    PHASES = ("generate", "split", "transformer_fit", "estimator_fit", "score")
 
     def __init__(self,
                  transformer,
                  estimator,
-                 data_generator
+                 data_generator,
+                 cache_dir=None,
+                 timing=False,
+                 cache_key=None
 				):
 				 
         self.transformer = transformer
         self.estimator = estimator
         self.data_generator = data_generator
+        self.cache_dir = cache_dir
+        self.timing = timing
+        self.cache_key = cache_key
+        if cache_dir is not None and cache_key is None:
+            self.cache_key = _generator_key(data_generator)
+        
+    def _cache_path(self, seed, kwargs):
+        """Directory of the cached dataset of one round"""
+        key = json.dumps([self.cache_key, sorted(kwargs.items()), int(seed)], default=repr)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:20]
+        generator = self.data_generator
+        while isinstance(generator, functools.partial):
+            generator = generator.func
+        name = re.sub(r"\W", "_", getattr(generator, "__name__", "data"))
+        return os.path.join(self.cache_dir, "{}-{}".format(name, digest))
         
-    def _run(self, kwargs):
+    def _generate(self, seed, kwargs):
+        """Generates data of one round or opens them from the cache
+        
+        The generator gets the seed as `random_state` if it accepts it,
+        the global numpy random state is seeded as well. Cached arrays are
+        opened as read-only memory maps.
+        """
+        if self.cache_dir is not None:
+            path = self._cache_path(seed, kwargs)
+            if os.path.isdir(path):
+                return (np.load(os.path.join(path, "X.npy"), mmap_mode="r"),
+                        np.load(os.path.join(path, "y.npy"), mmap_mode="r"))
+        np.random.seed(seed)
+        if "random_state" in inspect.signature(self.data_generator).parameters:
+            kwargs = dict(kwargs, random_state=seed)
+        X, y = self.data_generator(**kwargs)
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = tempfile.mkdtemp(dir=self.cache_dir)
+            np.save(os.path.join(tmp, "X.npy"), X)
+            np.save(os.path.join(tmp, "y.npy"), y)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # written meanwhile by another worker
+                shutil.rmtree(tmp, ignore_errors=True)
+        return X, y
+        
+    def _run(self, transformer, estimator, seed, kwargs, timer=NoTimer()):
         """Runs one round of simulation
+        
+        Every split is transformed once per fitted transformer and the
+        transformed matrices are reused by all scores, the splits are done on
+        row indices so that the leakage transform of the whole development
+        sample also serves its train and test part. The transformer phase
+        covers the transforms as well.
+        
+        :param transformer: unfitted transformer, refitted in place
+        :param estimator: unfitted estimator, refitted in place
+        :param seed: seed of the data generation and splits
+        :param timer: PhaseTimer measuring the phases of the round
 		"""
-        X_full, y_full = self.data_generator(**kwargs)
-        X_dev, X_prod, y_dev, y_prod = train_test_split(X_full,
-                                                        y_full,
-                                                        test_size=0.2)
-        X_train, X_test, y_train, y_test = train_test_split(X_dev,
-                                                            y_dev,
-                                                            test_size=0.25)
+        X_full, y_full = self._generate(seed, kwargs)
+        timer.lap(0)
+        dev, prod = train_test_split(np.arange(len(y_full)),
+                                     test_size=0.2,
+                                     random_state=seed)
+        train, test = train_test_split(np.arange(len(dev)),
+                                       test_size=0.25,
+                                       random_state=seed)
+        X_dev, X_prod = _take(X_full, dev), _take(X_full, prod)
+        y_dev, y_prod = _take(y_full, dev), _take(y_full, prod)
+        X_train, X_test = _take(X_dev, train), _take(X_dev, test)
+        y_train, y_test = _take(y_dev, train), _take(y_dev, test)
+        timer.lap(1)
         # correct
-        model_correct = Pipeline([('transformer', self.transformer),
-                                  ('estimator', self.estimator)])
-        model_correct.fit(X_train, y_train)
-        correct_train = model_correct.score(X_train, y_train)
-        correct_test = model_correct.score(X_test, y_test)
-        correct_prod = model_correct.score(X_prod, y_prod)
+        X_train_transformed = transformer.fit_transform(X_train, y_train)
+        X_test_transformed = transformer.transform(X_test)
+        X_prod_transformed = transformer.transform(X_prod)
+        timer.lap(2)
+        estimator.fit(X_train_transformed, y_train)
+        timer.lap(3)
+        correct_train = estimator.score(X_train_transformed, y_train)
+        correct_test = estimator.score(X_test_transformed, y_test)
+        correct_prod = estimator.score(X_prod_transformed, y_prod)
+        timer.lap(4)
         
         # leakage
-        self.transformer.fit(X_dev, y_dev)
-        self.estimator.fit(self.transformer.transform(X_train), y_train)
-        model_leakage = Pipeline([('transformer', self.transformer),
-                                  ('estimator', self.estimator)])
-        leakage_train = model_leakage.score(X_train, y_train)
-        leakage_test = model_leakage.score(X_test, y_test)
-        leakage_prod = model_leakage.score(X_prod, y_prod)
+        transformer.fit(X_dev, y_dev)
+        X_dev_transformed = transformer.transform(X_dev)
+        X_train_transformed = _take(X_dev_transformed, train)
+        X_test_transformed = _take(X_dev_transformed, test)
+        X_prod_transformed = transformer.transform(X_prod)
+        timer.lap(2)
+        estimator.fit(X_train_transformed, y_train)
+        timer.lap(3)
+        leakage_train = estimator.score(X_train_transformed, y_train)
+        leakage_test = estimator.score(X_test_transformed, y_test)
+        leakage_prod = estimator.score(X_prod_transformed, y_prod)
+        timer.lap(4)
        
         return correct_train, correct_test, correct_prod, \
                 leakage_train, leakage_test, leakage_prod
+                
+    def _run_batch(self, seeds, kwargs):
+        """Runs a batch of rounds in one worker
+        
+        Transformer and estimator are cloned once per batch, so the
+        simulation object itself is never modified.
+        
+        :param seeds: seeds of the rounds
+        :returns: np.ndarray of results of shape (len(seeds), 6), with
+            `timing` the phase times are appended as further columns
+        """
+        transformer = clone(self.transformer)
+        estimator = clone(self.estimator)
+        n_phases = len(self.PHASES) if self.timing else 0
+        results = np.zeros((len(seeds), 6 + n_phases))
+        for i, seed in enumerate(seeds):
+            timer = PhaseTimer(results[i,6:]) if self.timing else NoTimer()
+            results[i,:6] = self._run(transformer, estimator, seed, kwargs, timer)
+        return results
+        
+    def timing_summary(self):
+        """Per phase statistics of the round times of the last run
+        
+        :returns: dict {phase: {"total", "mean", "p50", "p90", "p99"}}
+            in seconds, ready to be dumped as JSON
+        """
+        summary = {}
+        for phase, times in zip(self.PHASES, self.timings_.T):
+            p50, p90, p99 = np.percentile(times, [50, 90, 99])
+            summary[phase] = {"total": float(times.sum()),
+                              "mean": float(times.mean()),
+                              "p50": float(p50), "p90": float(p90), "p99": float(p99)}
+        return summary
     
-    def run(self, n_simul=100, n_jobs=-1, verbose=True, **kwargs):
+    def run(self, n_simul=100, n_jobs=-1, verbose=True, batch_size=None,
+            pre_dispatch='2*n_jobs', random_state=None, **kwargs):
         """Runs the simulation `n_simul` number of times
         
+        Rounds are grouped into batches, one joblib task per batch, so that
+        the dispatch overhead does not dominate when rounds are cheap.
+        
         :param n_simul: number of simulation rounds
         :param n_jobs: number of parallel jobs
         :param verbose: whether to print out the results
+        :param batch_size: number of rounds per task
+            (default: about 4 tasks per worker)
+        :param pre_dispatch: number of tasks dispatched ahead, see joblib.Parallel
+        :param random_state: master seed the seeds of all rounds are drawn from,
+            the one used is kept in `random_state_`
         :Keyword Arguments: arguments of the data generator 
         
+        With `timing` the phase times of the rounds are kept in `timings_`
+        of shape (n_simul, len(PHASES)), see also `timing_summary`.
+        
         :returns: np.ndarray of results of shape (n_simul, 6),
             columns are ordered: correct train score, correct test score,
             correct prod score, leakage train score, leakage test score,
@@ -80,28 +309,281 @@ class TargetLeakageSimulation(object):
         """
         start = datetime.datetime.now()
         
-        results = Parallel(n_jobs=n_jobs) \
-        (delayed(self._run)(kwargs) for _ in range(n_simul))
-        results = np.asarray(results)
+        seed_sequence = np.random.SeedSequence(random_state)
+        self.random_state_ = seed_sequence.entropy
+        seeds = seed_sequence.generate_state(n_simul)
+        
+        if batch_size is None:
+            batch_size = max(1, n_simul // (4 * effective_n_jobs(n_jobs)))
+        batches = [seeds[i:i+batch_size] for i in range(0, n_simul, batch_size)]
+        
+        blocks = Parallel(n_jobs=n_jobs, pre_dispatch=pre_dispatch) \
+        (delayed(self._run_batch)(batch, kwargs) for batch in batches)
+        results = np.concatenate(blocks)
+        if self.timing:
+            self.timings_ = results[:,6:]
+            results = results[:,:6]
         
         duration = datetime.datetime.now() - start
+        self.throughput_ = n_simul / duration.total_seconds()
         
         if verbose:
-            self._report(results, duration)
+            self._report(results.mean(axis=0), len(results), duration)
             
         return results
         
-    def _report(self, results, duration):
+    def run_streaming(self, tol=0.01, max_simul=10000, min_simul=10, z=1.96,
+                      n_jobs=-1, verbose=True, batch_size=1,
+                      pre_dispatch='2*n_jobs', random_state=None, **kwargs):
+        """Runs the simulation until the leakage gap is known precisely enough
+        
+        Results are aggregated as the workers finish, only running means and
+        variances are kept. The simulation stops once the confidence interval
+        of the leakage gap (leakage test score - leakage prod score) is
+        narrower than `tol` on each side, or after `max_simul` rounds.
+        
+        :param tol: target half width of the confidence interval of the gap
+        :param max_simul: maximum number of simulation rounds
+        :param min_simul: minimum number of rounds before stopping
+        :param z: quantile of the normal distribution of the interval
+        :param batch_size: number of rounds per task
+        :returns: RunningStats of the 6 scores (ordered as in `run`)
+            and the leakage gap as the 7th metric
+        """
+        start = datetime.datetime.now()
+        
+        seed_sequence = np.random.SeedSequence(random_state)
+        self.random_state_ = seed_sequence.entropy
+        seeds = seed_sequence.generate_state(max_simul)
+        batches = [seeds[i:i+batch_size] for i in range(0, max_simul, batch_size)]
+        
+        stats = RunningStats(7)
+        timings = []
+        blocks = Parallel(n_jobs=n_jobs, pre_dispatch=pre_dispatch,
+                          return_as="generator_unordered") \
+        (delayed(self._run_batch)(batch, kwargs) for batch in batches)
+        for block in blocks:
+            timings.append(block[:,6:])
+            block = block[:,:6]
+            stats.update(np.column_stack([block, block[:,4] - block[:,5]]))
+            gap, halfwidth = stats.mean[6], stats.ci_halfwidth(z)[6]
+            if verbose:
+                print("\rRounds: {}, leakage gap: {:.4f} +- {:.4f}".format(
+                      stats.n, gap, halfwidth), end="", flush=True)
+            if stats.n >= min_simul and halfwidth < tol:
+                break
+        with warnings.catch_warnings():
+            # cancelling the remaining rounds is intended
+            warnings.simplefilter("ignore")
+            blocks.close()
+        if self.timing:
+            self.timings_ = np.concatenate(timings)
+        
+        duration = datetime.datetime.now() - start
+        self.throughput_ = stats.n / duration.total_seconds()
+        
+        if verbose:
+            print("")
+            print("")
+            self._report(stats.mean[:6], stats.n, duration)
+            
+        return stats
+        
+    def _report(self, means, n_rounds, duration):
         """Prints textual report of the simulation results
         """
         print("Correct approach:")
-        print("Train accuracy: {}".format(round(np.mean(results[:,0]), 4)))
-        print("Test accuracy: {}".format(round(np.mean(results[:,1]), 4)))
-        print("Production accuracy: {}".format(round(np.mean(results[:,2]), 4)))
+        print("Train accuracy: {}".format(round(means[0], 4)))
+        print("Test accuracy: {}".format(round(means[1], 4)))
+        print("Production accuracy: {}".format(round(means[2], 4)))
         print("")
         print("Leakage approach:")
-        print("Train accuracy: {}".format(round(np.mean(results[:,3]), 4)))
-        print("Test accuracy: {}".format(round(np.mean(results[:,4]), 4)))
-        print("Production accuracy: {}".format(round(np.mean(results[:,5]), 4)))
+        print("Train accuracy: {}".format(round(means[3], 4)))
+        print("Test accuracy: {}".format(round(means[4], 4)))
+        print("Production accuracy: {}".format(round(means[5], 4)))
         print("")
-        print("Simulation run in: {}".format(duration))
\ No newline at end of file
+        print("Master seed: {}".format(self.random_state_))
+        print("Rounds: {}".format(n_rounds))
+        print("Simulation run in: {}".format(duration))
+        print("Throughput: {} rounds/s".format(round(n_rounds / duration.total_seconds(), 2)))
+        if self.timing:
+            print("")
+            print("{:<16}{:>10}{:>10}{:>10}{:>10}".format(
+                  "Phase", "total s", "p50 ms", "p90 ms", "p99 ms"))
+            for phase, t in self.timing_summary().items():
+                print("{:<16}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+                      phase, t["total"], t["p50"]*1e3, t["p90"]*1e3, t["p99"]*1e3))
+
+
+def _cell_key(model, params):
+    """File name stem of one grid cell"""
+    key = json.dumps([model, sorted(params.items())], default=repr)
+    stem = re.sub(r"[^\w.-]", "_", model)
+    return "{}-{}".format(stem, hashlib.sha1(key.encode()).hexdigest()[:20])
+
+
+def _fingerprint(obj):
+    """Hash of a data generator or of an unfitted sklearn object
+    
+    Functions are hashed by name, code and closure, partials also by their
+    bound arguments, sklearn objects by their class and parameters.
+    """
+    if isinstance(obj, functools.partial):
+        return joblib.hash((_fingerprint(obj.func), obj.args, obj.keywords))
+    if inspect.isfunction(obj):
+        code = obj.__code__
+        cells = [cell.cell_contents for cell in obj.__closure__ or ()]
+        return joblib.hash((obj.__module__, obj.__qualname__,
+                            code.co_code, code.co_consts, cells))
+    if hasattr(obj, "get_params"):
+        return joblib.hash((type(obj).__module__, type(obj).__qualname__,
+                            obj.get_params()))
+    return joblib.hash(obj)
+
+
+def _cell_cost(params):
+    """Rough relative cost of a round, product of the integer arguments"""
+    cost = 1
+    for value in params.values():
+        if isinstance(value, (int, np.integer)) and not isinstance(value, bool) and value > 0:
+            cost *= int(value)
+    return cost
+
+
+def _run_task(simulation, key, seeds, kwargs):
+    return key, simulation._run_batch(seeds, kwargs)
+
+
+def sweep(models, data_generator, param_grid, results_dir, n_simul=100,
+          n_jobs=-1, batch_size=None, pre_dispatch='2*n_jobs',
+          random_state=None, cache_dir=None, cache_key=None, verbose=True):
+    """Runs the simulation on every point of a grid of data generator arguments
+    
+    All (grid point x model x round batch) tasks are scheduled on a single
+    worker pool, the most expensive ones (largest product of the integer
+    arguments, e.g. n_samples * n_features) first. Each cell writes its
+    results to `results_dir` as soon as all of its rounds finish, cells
+    already present there are skipped, so an interrupted sweep can be resumed
+    by calling it again (with the same data generator, and the same
+    transformer and estimator under each model name). Every cell uses the same round seeds (common random
+    numbers), so the differences between grid points are not blurred by
+    different data draws.
+    
+    :param models: dict {name: (transformer, estimator)}
+    :param data_generator: callable returning data as a tuple (X, y)
+    :param param_grid: dict (or list of dicts) of lists of data generator
+        arguments, see sklearn.model_selection.ParameterGrid
+    :param results_dir: directory of the per cell result files
+    :param n_simul: number of simulation rounds per cell
+    :param batch_size: number of rounds per task (default: about 4 tasks
+        per worker and cell)
+    :param random_state: master seed, a resumed sweep reuses the stored one
+    :param cache_dir: optional dataset cache, see TargetLeakageSimulation
+    :param cache_key: identity of the generator in the dataset cache
+    :returns: columnar results, see `load_sweep`
+    """
+    start = datetime.datetime.now()
+    os.makedirs(results_dir, exist_ok=True)
+    
+    generator = _fingerprint(data_generator)
+    fingerprints = {name: [_fingerprint(transformer), _fingerprint(estimator)]
+                    for name, (transformer, estimator) in models.items()}
+    meta_path = os.path.join(results_dir, "sweep.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if random_state is None:
+            random_state = meta["random_state"]
+        if (meta["random_state"], meta["n_simul"]) != (random_state, n_simul):
+            raise ValueError("{} was run with random_state={} and n_simul={}"
+                             .format(results_dir, meta["random_state"], meta["n_simul"]))
+        if meta.get("generator") != generator:
+            raise ValueError("{} was run with a different data generator".format(results_dir))
+        stored = meta.setdefault("models", {})
+        changed = [name for name in models
+                   if stored.get(name, fingerprints[name]) != fingerprints[name]]
+        if changed:
+            raise ValueError("{} was run with a different transformer or estimator as {}"
+                             .format(results_dir, ", ".join(changed)))
+        stored.update(fingerprints)
+    else:
+        random_state = np.random.SeedSequence(random_state).entropy
+        meta = {"random_state": random_state, "n_simul": n_simul,
+                "generator": generator, "models": fingerprints}
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    seeds = np.random.SeedSequence(random_state).generate_state(n_simul)
+    
+    if batch_size is None:
+        batch_size = max(1, n_simul // (4 * effective_n_jobs(n_jobs)))
+    batches = [seeds[i:i+batch_size] for i in range(0, n_simul, batch_size)]
+    
+    simulations = {name: TargetLeakageSimulation(transformer, estimator,
+                                                 data_generator, cache_dir,
+                                                 cache_key=cache_key)
+                   for name, (transformer, estimator) in models.items()}
+    cells = {}
+    for params in ParameterGrid(param_grid):
+        for name in models:
+            key = _cell_key(name, params)
+            if not os.path.exists(os.path.join(results_dir, key + ".npz")):
+                cells[key] = (name, params)
+    if verbose:
+        print("Cells to run: {}, already finished: {}".format(
+              len(cells), len(models) * len(ParameterGrid(param_grid)) - len(cells)))
+    
+    tasks = [(key, i) for key in cells for i in range(len(batches))]
+    tasks.sort(key=lambda task: -_cell_cost(cells[task[0]][1]) * len(batches[task[1]]))
+    blocks = {key: [] for key in cells}
+    
+    outputs = Parallel(n_jobs=n_jobs, pre_dispatch=pre_dispatch,
+                       return_as="generator_unordered") \
+    (delayed(_run_task)(simulations[cells[key][0]], (key, i), batches[i], cells[key][1])
+     for key, i in tasks)
+    for (key, i), block in outputs:
+        blocks[key].append((i, block))
+        if len(blocks[key]) < len(batches):
+            continue
+        results = np.concatenate([block for i, block in sorted(blocks.pop(key), key=lambda b: b[0])])
+        name, params = cells[key]
+        tmp = os.path.join(results_dir, key + ".tmp.npz")
+        np.savez(tmp, results=results, model=name,
+                 params=json.dumps(params, default=repr))
+        os.replace(tmp, os.path.join(results_dir, key + ".npz"))
+        if verbose:
+            print("{} {}: leakage gap {:.4f}".format(
+                  name, params, np.mean(results[:,4] - results[:,5])))
+    
+    if verbose:
+        print("Sweep run in: {}".format(datetime.datetime.now() - start))
+    return load_sweep(results_dir)
+
+
+def load_sweep(results_dir):
+    """Loads the results of a sweep as columns
+    
+    :returns: dict of np.ndarrays with one row per grid cell: "model",
+        one column per data generator argument, "n" (number of rounds),
+        mean scores "correct_train", "correct_test", "correct_prod",
+        "leakage_train", "leakage_test", "leakage_prod" and "results"
+        with all rounds of shape (n_cells, n_simul, 6)
+    """
+    names = ["correct_train", "correct_test", "correct_prod",
+             "leakage_train", "leakage_test", "leakage_prod"]
+    rows = []
+    for file in sorted(os.listdir(results_dir)):
+        if file.endswith(".npz") and not file.endswith(".tmp.npz"):
+            with np.load(os.path.join(results_dir, file)) as data:
+                rows.append((str(data["model"]), json.loads(str(data["params"])),
+                             data["results"]))
+    
+    params = sorted({param for row in rows for param in row[1]})
+    columns = {"model": np.array([row[0] for row in rows])}
+    for param in params:
+        columns[param] = np.array([row[1].get(param) for row in rows])
+    columns["n"] = np.array([len(row[2]) for row in rows])
+    means = np.array([row[2].mean(axis=0) for row in rows]).reshape(-1, 6)
+    for j, name in enumerate(names):
+        columns[name] = means[:,j]
+    columns["results"] = np.array([row[2] for row in rows])
+    return columns
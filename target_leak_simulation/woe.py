@@ -1,5 +1,4 @@
 import numpy as np
-import math
 from sklearn.base import BaseEstimator, TransformerMixin
 
 class WoETransformer(BaseEstimator, TransformerMixin):
@@ -10,12 +9,29 @@ class WoETransformer(BaseEstimator, TransformerMixin):
 	:param event: name of possitive class
 	:param WOE_MIN: nimimum to clip the woe values to
 	:param WOE_MAX: maximum to clip the woe values to
+	:param max_categories: high cardinality mode, keep exact counts only
+		for this many most frequent categories of every feature
+		(None keeps all categories)
+	:param n_buckets: number of hashed buckets the rare categories are
+		folded into in the high cardinality mode (1 = single "other" bucket)
+	
+	In the high cardinality mode categories are identified by 64-bit hashes
+	and the most frequent ones are tracked by a streaming heavy hitters
+	(space saving) sketch. A category evicted from the sketch adds its
+	counts to its bucket, unseen categories get the woe of their bucket.
+	The fitted state are numeric arrays only and `woe` is left empty.
 	"""
-	def __init__(self, cat_feats=None, event=1, WOE_MIN=-10, WOE_MAX=10):
-		self._WOE_MIN = WOE_MIN
-		self._WOE_MAX = WOE_MAX
+	FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+	FNV_PRIME = np.uint64(0x100000001b3)
+
+	def __init__(self, cat_feats=None, event=1, WOE_MIN=-10, WOE_MAX=10,
+	             max_categories=None, n_buckets=1):
+		self.WOE_MIN = WOE_MIN
+		self.WOE_MAX = WOE_MAX
 		self.cat_feats = cat_feats
 		self.event = event
+		self.max_categories = max_categories
+		self.n_buckets = n_buckets
 
 	def fit(self, X, y):
 		"""Fits the transformer
@@ -23,20 +39,86 @@ class WoETransformer(BaseEstimator, TransformerMixin):
 		:param X: two dimentional np.ndarray of input features
 		:param y: one dimentional np.ndarray of target variable
 		"""
-		X_ = X.copy()       
-		res_woe_dict = {}
-		res_iv_dict = {}
+		self._reset()
+		return self.partial_fit(X, y).compute_woe()
+
+	def partial_fit(self, X, y):
+		"""Adds event and non-event counts of a chunk of data
+		
+		Woe and iv are computed from all the counts seen so far by
+		`compute_woe`, which is called by `transform` when needed.
 		
+		:param X: two dimentional np.ndarray, chunk of input features
+		:param y: one dimentional np.ndarray, chunk of target variable
+		"""
+		if not hasattr(self, "_counts"):
+			self._reset()
 		if self.cat_feats == None:
 			self.cat_feats = [i for i in range(X.shape[1])]
+		event_total, non_event_total = self._count_binary(y, event=self.event)
+		self._event_total += event_total
+		self._non_event_total += non_event_total
 		for feat in self.cat_feats:
-			X_[:,feat] = X_[:,feat].astype(str)
-			woe_dict, iv1 = self._woe_single_x(X_[:,feat], y, self.event)
-			res_woe_dict[feat] = woe_dict
+			if self.max_categories is None:
+				counts = self._count_single_x(self._as_labels(X[:,feat]), y, self.event)
+				self._counts[feat] = self._merge_counts(self._counts.get(feat), counts)
+			else:
+				keys, event_counts, non_event_counts = self._count_single_x(
+					self._hash_labels(X[:,feat]), y, self.event)
+				buckets = np.zeros(self.n_buckets, dtype=np.int64)
+				sketch = (keys, event_counts + non_event_counts, event_counts,
+				          non_event_counts, buckets, buckets)
+				self._counts[feat] = self._merge_sketch(self._counts.get(feat), sketch)
+		self._stale = True
+		return self
+
+	def merge(self, other):
+		"""Adds counts of another transformer, e.g. fitted on a different shard
+		
+		:param other: WoETransformer with the same cat_feats and event
+		"""
+		if not hasattr(self, "_counts"):
+			self._reset()
+			self.cat_feats = other.cat_feats
+		self._event_total += other._event_total
+		self._non_event_total += other._non_event_total
+		merge = self._merge_counts if self.max_categories is None else self._merge_sketch
+		for feat, counts in other._counts.items():
+			self._counts[feat] = merge(self._counts.get(feat), counts)
+		self._stale = True
+		return self
+
+	def compute_woe(self):
+		"""Computes woe and iv of all features from the accumulated counts
+		"""
+		res_woe_dict = {}
+		res_iv_dict = {}
+		self._labels = {}
+		self._woe_values = {}
+		self._bucket_woe = {}
+		
+		for feat, counts in self._counts.items():
+			if self.max_categories is None:
+				labels, event_counts, non_event_counts = counts
+				woe, iv1 = self._woe_from_counts(event_counts, non_event_counts,
+				                                 self._event_total, self._non_event_total)
+				res_woe_dict[feat] = dict(zip(labels, woe.tolist()))
+			else:
+				labels, _, event_counts, non_event_counts, bucket_event, bucket_non_event = counts
+				woe, iv1 = self._woe_from_counts(np.concatenate([event_counts, bucket_event]),
+				                                 np.concatenate([non_event_counts, bucket_non_event]),
+				                                 self._event_total, self._non_event_total)
+				woe, bucket_woe = woe[:len(labels)], woe[len(labels):]
+				# empty buckets behave as unseen categories
+				bucket_woe[bucket_event + bucket_non_event == 0] = 0
+				self._bucket_woe[feat] = bucket_woe
+			self._labels[feat] = labels
+			self._woe_values[feat] = woe
 			res_iv_dict[feat] = iv1
         
 		self.woe = res_woe_dict
 		self.iv = res_iv_dict
+		self._stale = False
 		return self
         
 	def transform(self, X):
@@ -44,33 +126,163 @@ class WoETransformer(BaseEstimator, TransformerMixin):
 		
 		:param X: two dimentional np.ndarray of data to be encoded
 		"""
+		if self._stale:
+			self.compute_woe()
 		X_ = X.copy()
 		for feat in self.cat_feats:
-			X_[:,feat] = X_[:,feat].astype(str)
-			X_[:,feat] = np.array([self.woe[feat][x] if x in self.woe[feat].keys() else 0 for x in X_[:,feat]])
+			X_[:,feat] = self._encode(X[:,feat], feat)
 		return X_
 
-	def _woe_single_x(self, x, y, event):
-		"""Compute woe for a single feature
+	def transform_chunks(self, X, out, chunk_size=100000):
+		"""Encode data chunk by chunk into a caller supplied float buffer
+		
+		Only one chunk of the input is held in memory at a time, so `X`
+		can be a np.memmap larger than RAM and `out` a writable one.
+		
+		:param X: two dimentional array sliced into chunks of `chunk_size`
+			rows, or an iterator of two dimentional chunks
+		:param out: float np.ndarray of shape (n_rows, n_features) to write to
+		:returns: out
 		"""
-		event_total, non_event_total = self._count_binary(y, event=event)
-		x_labels = np.unique(x)
-		woe_dict = {}
-		iv = 0
-		for x1 in x_labels:
-			y1 = y[np.where(x == x1)[0]]
-			event_count, non_event_count = self._count_binary(y1, event=event)
-			rate_event = 1.0 * event_count / event_total
-			rate_non_event = 1.0 * non_event_count / non_event_total
-			if rate_event == 0:
-				woe1 = self._WOE_MIN
-			elif rate_non_event == 0:
-				woe1 = self._WOE_MAX
+		if self._stale:
+			self.compute_woe()
+		chunks = X
+		if hasattr(X, "shape"):
+			chunks = (X[i:i+chunk_size] for i in range(0, X.shape[0], chunk_size))
+		start = 0
+		for chunk in chunks:
+			block = out[start:start+chunk.shape[0]]
+			other = [i for i in range(chunk.shape[1]) if i not in self.cat_feats]
+			block[:,other] = chunk[:,other]
+			for feat in self.cat_feats:
+				block[:,feat] = self._encode(chunk[:,feat], feat)
+			start += chunk.shape[0]
+		return out
+
+	def __sklearn_is_fitted__(self):
+		return hasattr(self, "_labels")
+
+	def _reset(self):
+		self._counts = {}
+		self._event_total = 0
+		self._non_event_total = 0
+		self._stale = True
+
+	def _encode(self, x, feat):
+		"""Look up woe of a single feature, unseen labels get 0
+		(the woe of their bucket in the high cardinality mode)
+		"""
+		if self.max_categories is None:
+			x = self._as_labels(x)
+			default = 0
+		else:
+			x = self._hash_labels(x)
+			default = self._bucket_woe[feat][x % np.uint64(self.n_buckets)]
+		labels = self._labels[feat]
+		if len(labels) == 0:
+			return np.zeros(len(x)) + default
+		ids = np.minimum(np.searchsorted(labels, x), len(labels) - 1)
+		return np.where(labels[ids] == x, self._woe_values[feat][ids], default)
+
+	def _as_labels(self, x):
+		"""Labels of a single feature
+		
+		Numeric columns are used as they are, since their string form
+		would be cast back to the column dtype anyway, others as strings.
+		"""
+		if x.dtype.kind in "biuf":
+			return x
+		return x.astype(str)
+
+	def _hash_labels(self, x):
+		"""64-bit hashes of labels of a single feature
+		
+		Strings are hashed by FNV-1a over their code points, vectorized over
+		rows, numbers by mixing the bits of their int64 or float64 value, so the
+		hashes are the same in every process and for every chunk.
+		"""
+		if x.dtype.kind in "biuf":
+			if x.dtype.kind == "f":
+				h = x.astype(np.float64).view(np.uint64)
 			else:
-				woe1 = math.log(rate_event / rate_non_event)
-			woe_dict[x1] = woe1
-			iv += (rate_event - rate_non_event) * woe1
-		return woe_dict, iv
+				# exact for all 64-bit integers, float64 would merge those above 2**53
+				h = x.astype(np.int64).view(np.uint64)
+			h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+			h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+			return h ^ (h >> np.uint64(31))
+		if len(x) == 0:
+			return np.empty(0, dtype=np.uint64)
+		x = np.ascontiguousarray(x.astype(str))
+		codes = x.view(np.uint32).reshape(len(x), -1).astype(np.uint64)
+		h = np.full(len(x), self.FNV_OFFSET)
+		for code in codes.T:
+			# padding of shorter strings must not change their hash
+			h = np.where(code != 0, (h ^ code) * self.FNV_PRIME, h)
+		return h
+
+	def _count_single_x(self, x, y, event):
+		"""Count events and non-events of every label of a single feature
+		
+		Counts all labels in one pass using the inverse codes of np.unique.
+		
+		:returns: sorted labels, their event counts and non-event counts
+		"""
+		labels, codes = np.unique(x, return_inverse=True)
+		counts = np.bincount(codes, minlength=len(labels))
+		event_counts = np.bincount(codes[y == event], minlength=len(labels))
+		return labels, event_counts, counts - event_counts
+
+	def _merge_counts(self, a, b):
+		"""Sum label counts of two (labels, event_counts, non_event_counts)
+		"""
+		if a is None:
+			return b
+		labels, codes = np.unique(np.concatenate([a[0], b[0]]), return_inverse=True)
+		event_counts = np.bincount(codes, np.concatenate([a[1], b[1]]), len(labels))
+		non_event_counts = np.bincount(codes, np.concatenate([a[2], b[2]]), len(labels))
+		return labels, event_counts.astype(np.int64), non_event_counts.astype(np.int64)
+
+	def _merge_sketch(self, a, b):
+		"""Merge two heavy hitter sketches
+		
+		Sketch is a tuple (keys, weights, event_counts, non_event_counts,
+		bucket_event_counts, bucket_non_event_counts), weights are the
+		space saving estimates of category frequencies used for ranking.
+		Keeps `max_categories` heaviest keys and folds the rest into buckets.
+		"""
+		if a is None:
+			a = tuple(v[:0] for v in b[:4]) + (np.zeros_like(b[4]), np.zeros_like(b[5]))
+		keys, codes = np.unique(np.concatenate([a[0], b[0]]), return_inverse=True)
+		weights, event_counts, non_event_counts = (
+			np.bincount(codes, np.concatenate([a[i], b[i]]), len(keys)).astype(np.int64)
+			for i in (1, 2, 3))
+		if len(a[0]) >= self.max_categories:
+			# new keys could have been evicted before with up to the minimal weight
+			weights[~np.isin(keys, a[0])] += a[1].min()
+		bucket_event = a[4] + b[4]
+		bucket_non_event = a[5] + b[5]
+		if len(keys) > self.max_categories:
+			order = np.argsort(-weights, kind="stable")
+			drop = order[self.max_categories:]
+			buckets = (keys[drop] % np.uint64(self.n_buckets)).astype(np.intp)
+			bucket_event = bucket_event + np.bincount(buckets, event_counts[drop], self.n_buckets).astype(np.int64)
+			bucket_non_event = bucket_non_event + np.bincount(buckets, non_event_counts[drop], self.n_buckets).astype(np.int64)
+			keep = np.sort(order[:self.max_categories])
+			keys, weights = keys[keep], weights[keep]
+			event_counts, non_event_counts = event_counts[keep], non_event_counts[keep]
+		return keys, weights, event_counts, non_event_counts, bucket_event, bucket_non_event
+
+	def _woe_from_counts(self, event_counts, non_event_counts, event_total, non_event_total):
+		"""Compute woe values and information value from label counts
+		"""
+		with np.errstate(divide="ignore", invalid="ignore"):
+			rate_event = 1.0 * event_counts / event_total
+			rate_non_event = 1.0 * non_event_counts / non_event_total
+			woe = np.log(rate_event / rate_non_event)
+		woe[rate_non_event == 0] = self.WOE_MAX
+		woe[rate_event == 0] = self.WOE_MIN
+		iv = ((rate_event - rate_non_event) * woe).sum()
+		return woe, iv
         
 	def _count_binary(self, a, event):
 		"""Counts events in given array